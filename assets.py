@@ -0,0 +1,106 @@
+# assets.py
+# Template helpers for the hashed files written by build_assets.py.
+# asset_url() takes the same arguments as url_for() and swaps a static
+# filename for its hashed build output when the manifest has one, so templates
+# keep working (with the plain files) before the build step has ever run.
+import os
+import json
+import time
+import threading
+
+from flask import url_for
+from markupsafe import Markup
+
+MANIFEST_FILE = os.path.join("static", "build", "manifest.json")
+MANIFEST_RECHECK_SECONDS = 5
+
+
+class AssetManifest:
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def entries(self):
+        """Manifest contents, re-read when the file changes (checked every few seconds)."""
+        now = time.monotonic()
+        if now - self._checked_at < MANIFEST_RECHECK_SECONDS:
+            return self._entries
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._entries, self._mtime = {}, None
+                return self._entries
+            if mtime != self._mtime:
+                try:
+                    with open(self.path) as f:
+                        self._entries = json.load(f)
+                    self._mtime = mtime
+                except (OSError, ValueError) as e:
+                    print(f"Error loading asset manifest: {e}")
+        return self._entries
+
+    def get(self, filename):
+        return self.entries().get(filename)
+
+    @property
+    def version(self):
+        """Changes whenever a new manifest is loaded; lets callers cache pages that link to assets."""
+        self.entries()
+        return self._mtime
+
+
+manifest = AssetManifest()
+
+
+def asset_url(endpoint, **values):
+    """url_for() that resolves static files to their hashed build output."""
+    if endpoint == "static" and "filename" in values:
+        entry = manifest.get(values["filename"])
+        if entry:
+            values["filename"] = entry["path"]
+    return url_for(endpoint, **values)
+
+
+def _variants(filename, mime=None):
+    entry = manifest.get(filename)
+    if not entry:
+        return []
+    return [v for v in entry["variants"] if mime is None or v["type"] == mime]
+
+
+def asset_srcset(filename, mime):
+    """srcset value with every width built for filename in one format ("" if none)."""
+    return ", ".join(
+        f"{url_for('static', filename=v['path'])} {v['width']}w" for v in _variants(filename, mime)
+    )
+
+
+def asset_image_set(filename, max_width=None):
+    """
+    CSS image-set() offering each built format at the widest width up to
+    max_width, for backgrounds; falls back to a plain url() without a build.
+    """
+    by_type = {}
+    for v in _variants(filename):
+        by_type.setdefault(v["type"], []).append(v)
+    for mime, options in by_type.items():
+        fitting = [v for v in options if not max_width or v["width"] <= max_width]
+        by_type[mime] = max(fitting, key=lambda v: v["width"]) if fitting else min(options, key=lambda v: v["width"])
+    if not by_type:
+        return Markup(f'url("{asset_url("static", filename=filename)}")')
+    options = [f'url("{url_for("static", filename=v["path"])}") type("{mime}")' for mime, v in by_type.items()]
+    return Markup(f"image-set({', '.join(options)})") # Quotes must not be HTML-escaped inside <style>
+
+
+def is_hashed_asset(filename):
+    return filename.startswith("build/") and not filename.endswith(".json")
+
+
+def register(app):
+    manifest.path = os.path.join(app.static_folder, "build", "manifest.json")
+    app.jinja_env.globals.update(asset_url=asset_url, asset_srcset=asset_srcset, asset_image_set=asset_image_set)
@@ -0,0 +1,324 @@
+# avatars.py
+# Local proxy for player face images. Each face is fetched from the avatar
+# service once, kept on disk and revalidated in the background, so browsers
+# only ever talk to us. build_sprite() packs every cached face into one PNG
+# plus a coordinate map so the player grid can render from a single image.
+# Sprites are built in the background, once per set of faces across all
+# workers (written to AVATAR_DIR under the set's hash); requests only ever
+# serve the last finished one.
+import os
+import re
+import json
+import math
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import client
+from storage import gevent_threadpool
+
+try:
+    import fcntl
+except ImportError: # Windows: every worker builds its own sprite
+    fcntl = None
+
+AVATAR_DIR = "avatar_cache"
+AVATAR_SOURCE_URL = os.environ.get("AVATAR_SOURCE_URL", "https://crafatar.com/avatars/{uuid}?size=64&overlay")
+AVATAR_SIZE = 64
+AVATAR_REVALIDATE_SECONDS = 24 * 3600 # Re-fetch faces older than this in the background
+AVATAR_FETCH_WORKERS = 4
+AVATAR_MAX_PENDING = 256 # Fetches queued at once; more are skipped until the queue drains
+SPRITE_MAX_TILES = 400 # Faces beyond this are loaded individually by the grid
+SPRITE_KEEP_SECONDS = 3600 # Older sprite files are deleted once a newer one is written
+
+UUID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = ThreadPoolExecutor(max_workers=AVATAR_FETCH_WORKERS, thread_name_prefix="avatars")
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def normalize_uuid(uuid):
+    uuid = (uuid or "").replace("-", "").lower()
+    return uuid if UUID_RE.match(uuid) else None
+
+
+def avatar_path(uuid):
+    return os.path.join(AVATAR_DIR, f"{uuid}.png")
+
+
+def fetch_avatar(uuid):
+    """Download one face and store it atomically. Returns True on success."""
+    try:
+        response = client.get(AVATAR_SOURCE_URL.format(uuid=uuid))
+        if response.status_code != 200 or not response.content.startswith(PNG_SIGNATURE):
+            print(f"Avatar fetch for {uuid} returned {response.status_code}")
+            return False
+        os.makedirs(AVATAR_DIR, exist_ok=True)
+        tmp_path = f"{avatar_path(uuid)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, avatar_path(uuid))
+        return True
+    except Exception as e:
+        print(f"Error fetching avatar {uuid}: {e}")
+        return False
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(uuid)
+
+
+def schedule_fetch(uuid):
+    with _in_flight_lock:
+        if uuid in _in_flight or len(_in_flight) >= AVATAR_MAX_PENDING:
+            return
+        _in_flight.add(uuid)
+    _executor.submit(fetch_avatar, uuid)
+
+
+def get_avatar(uuid):
+    """
+    Path of the cached face, or None if it isn't on disk yet. Never blocks on
+    the network: missing and old faces are (re)fetched in the background.
+    """
+    path = avatar_path(uuid)
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        schedule_fetch(uuid)
+        return None
+    if age > AVATAR_REVALIDATE_SECONDS:
+        schedule_fetch(uuid)
+    return path
+
+
+# --- Minimal PNG codec (8-bit, non-interlaced) so sprites need no image library ---
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def decode_png(data):
+    """Decode an 8-bit RGB/RGBA/palette PNG into (width, height, RGBA rows)."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG")
+    pos = len(PNG_SIGNATURE)
+    idat = []
+    palette = transparency = None
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif chunk_type == b"PLTE":
+            palette = [tuple(body[i:i + 3]) for i in range(0, len(body), 3)]
+        elif chunk_type == b"tRNS":
+            transparency = body
+        elif chunk_type == b"IDAT":
+            idat.append(body)
+        elif chunk_type == b"IEND":
+            break
+    if depth != 8 or interlace or color_type not in (2, 3, 6):
+        raise ValueError("unsupported PNG format")
+    channels = {2: 3, 3: 1, 6: 4}[color_type]
+    stride = width * channels
+    raw = zlib.decompress(b"".join(idat))
+    rows = []
+    previous = bytearray(stride)
+    for y in range(height):
+        offset = y * (stride + 1)
+        filter_type = raw[offset]
+        line = bytearray(raw[offset + 1:offset + 1 + stride])
+        for i in range(stride):
+            left = line[i - channels] if i >= channels else 0
+            up = previous[i]
+            up_left = previous[i - channels] if i >= channels else 0
+            if filter_type == 1:
+                line[i] = (line[i] + left) & 0xFF
+            elif filter_type == 2:
+                line[i] = (line[i] + up) & 0xFF
+            elif filter_type == 3:
+                line[i] = (line[i] + ((left + up) >> 1)) & 0xFF
+            elif filter_type == 4:
+                line[i] = (line[i] + _paeth(left, up, up_left)) & 0xFF
+        previous = line
+        if color_type == 6:
+            rows.append(bytes(line))
+        elif color_type == 2:
+            rows.append(b"".join(bytes(line[i:i + 3]) + b"\xff" for i in range(0, stride, 3)))
+        else:
+            alpha = transparency or b""
+            rows.append(b"".join(
+                bytes(palette[index]) + bytes([alpha[index] if index < len(alpha) else 255]) for index in line
+            ))
+    return width, height, rows
+
+
+def encode_png(width, height, rows):
+    """Encode RGBA rows as a PNG (no filtering, zlib level 9)."""
+    def chunk(chunk_type, body):
+        return struct.pack(">I", len(body)) + chunk_type + body + struct.pack(">I", zlib.crc32(chunk_type + body))
+    raw = b"".join(b"\x00" + row for row in rows)
+    return (
+        PNG_SIGNATURE
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 9))
+        + chunk(b"IEND", b"")
+    )
+
+
+# --- Sprite atlas ---
+_sprite = None # (key, png, map) of the last finished sprite; replaced as a whole
+_sprite_lock = threading.Lock()
+_building = None # Key being built in the background, if any
+_decoded_faces = {} # uuid -> (mtime, RGBA rows); faces are only decoded again when their file changes
+
+
+def _load_face(uuid, path, mtime):
+    cached = _decoded_faces.get(uuid)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        width, height, rows = decode_png(f.read())
+    if width != AVATAR_SIZE or height != AVATAR_SIZE:
+        raise ValueError(f"unexpected size {width}x{height}")
+    _decoded_faces[uuid] = (mtime, rows)
+    return rows
+
+
+def sprite_faces(uuids):
+    """
+    (key, faces) for the cached faces of uuids, up to SPRITE_MAX_TILES. The key
+    hashes the faces and their file times, so it changes when any face does.
+    Faces that aren't cached yet are left out (and fetched in the background).
+    """
+    faces = []
+    for uuid in dict.fromkeys(uuids):
+        if len(faces) >= SPRITE_MAX_TILES:
+            break
+        path = get_avatar(uuid)
+        if path:
+            faces.append((uuid, path, os.path.getmtime(path)))
+    return hashlib.sha1(json.dumps(faces).encode()).hexdigest(), faces
+
+
+def _sprite_path(key, ext):
+    return os.path.join(AVATAR_DIR, f"sprite-{key}.{ext}")
+
+
+def build_sprite(faces):
+    """
+    Pack faces (from sprite_faces) into one PNG. Returns (png_bytes, map) where
+    map is {"size": tile size, "width"/"height": sheet size, "tiles": {uuid: [x, y]}}.
+    Decoding and encoding run in pure Python; call this off the request path.
+    """
+    size = AVATAR_SIZE
+    tiles = {}
+    decoded = []
+    for uuid, path, mtime in faces:
+        try:
+            decoded.append((uuid, _load_face(uuid, path, mtime)))
+        except (OSError, ValueError, zlib.error, struct.error) as e:
+            print(f"Skipping avatar {uuid} in sprite: {e}")
+
+    columns = max(1, math.ceil(math.sqrt(len(decoded))))
+    sheet_rows = max(1, math.ceil(len(decoded) / columns))
+    blank = b"\x00" * (size * 4)
+    lines = [[blank] * columns for _ in range(sheet_rows * size)]
+    for index, (uuid, rows) in enumerate(decoded):
+        col, row = index % columns, index // columns
+        for y in range(size):
+            lines[row * size + y][col] = rows[y]
+        tiles[uuid] = [col * size, row * size]
+    png = encode_png(columns * size, sheet_rows * size, [b"".join(line) for line in lines])
+    return png, {"size": size, "width": columns * size, "height": sheet_rows * size, "tiles": tiles}
+
+
+def load_sprite(key):
+    """(key, png, map) of a sprite another worker (or this one) already wrote, or None."""
+    try:
+        with open(_sprite_path(key, "png"), "rb") as f:
+            png = f.read()
+        with open(_sprite_path(key, "json")) as f:
+            sprite_map = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return key, png, {**sprite_map, "key": key}
+
+
+def _write_sprite(key, png, sprite_map):
+    os.makedirs(AVATAR_DIR, exist_ok=True)
+    for ext, data in (("png", png), ("json", json.dumps(sprite_map).encode())):
+        tmp_path = f"{_sprite_path(key, ext)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, _sprite_path(key, ext))
+    # The map file is written last, so load_sprite never sees a half-written pair
+    cutoff = time.time() - SPRITE_KEEP_SECONDS
+    for filename in os.listdir(AVATAR_DIR):
+        path = os.path.join(AVATAR_DIR, filename)
+        if filename.startswith("sprite-") and key not in filename and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+def _build_in_background(key, faces):
+    global _sprite, _building
+    try:
+        sprite = load_sprite(key)
+        if sprite is None:
+            with open(os.path.join(AVATAR_DIR, "sprite.lock"), "a") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return # Another worker is building; its file is picked up next request
+                sprite = load_sprite(key) # It may have finished while we waited for the lock
+                if sprite is None:
+                    png, sprite_map = build_sprite(faces)
+                    _write_sprite(key, png, sprite_map)
+                    sprite = (key, png, {**sprite_map, "key": key})
+        with _sprite_lock:
+            _sprite = sprite
+    except Exception as e:
+        print(f"Error building avatar sprite: {e}")
+    finally:
+        with _sprite_lock:
+            _building = None
+
+
+def current_sprite(uuids):
+    """
+    The newest finished sprite as (key, png, map), or None before the first is
+    ready. Never builds in the caller: if the faces changed, a build for the new
+    set starts in the background (on a real OS thread under gevent, since it is
+    CPU-bound) and the previous sprite is served until it's done.
+    """
+    global _sprite, _building
+    key, faces = sprite_faces(uuids)
+    sprite = _sprite
+    if sprite is not None and sprite[0] == key:
+        return sprite
+    on_disk = load_sprite(key)
+    with _sprite_lock:
+        if on_disk is not None:
+            _sprite = on_disk
+            return on_disk
+        if _building is None:
+            _building = key
+            os.makedirs(AVATAR_DIR, exist_ok=True)
+            threadpool = gevent_threadpool()
+            if threadpool is not None:
+                threadpool.spawn(_build_in_background, key, faces)
+            else:
+                threading.Thread(target=_build_in_background, args=(key, faces), name="avatar-sprite", daemon=True).start()
+        return _sprite
@@ -0,0 +1,296 @@
+# benchmark.py
+# Load test for the web app against local stand-ins for Mojang, Discord OAuth
+# and the avatar service. Runs in a scratch directory with its own database.
+#
+#   python benchmark.py --players 5000 --concurrency 16 --requests 500
+#   python benchmark.py --players 50000 --upstream-latency 150 --upstream-errors 0.05 -o result.json
+#   python benchmark.py --baseline result.json --tolerance 0.25   # exit 1 on regressions
+#
+# For each endpoint it reports p50/p95/p99 latency, throughput, status codes,
+# database statements per request and upstream calls, as JSON.
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ENDPOINTS = ("index", "whitelist", "callback", "submit", "players", "players_page")
+
+
+# --- Upstream stand-ins ---
+def fake_uuid(name):
+    return hashlib.md5(name.lower().encode()).hexdigest()
+
+
+def fake_discord_id(seed):
+    return str(10 ** 17 + int(hashlib.md5(seed.encode()).hexdigest()[:12], 16))
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    latency = 0.0 # seconds, +/- 50% jitter
+    error_rate = 0.0
+    calls = {}
+    calls_lock = threading.Lock()
+
+    def _delay_or_fail(self):
+        with self.calls_lock:
+            key = self.path.split("/")[1]
+            self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.error_rate:
+            self._send(503, {"error": "injected failure"})
+            return True
+        return False
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._delay_or_fail():
+            return
+        if self.path == "/mojang/profiles/minecraft":
+            names = json.loads(body)
+            self._send(200, [{"id": fake_uuid(n), "name": n} for n in names])
+        elif self.path == "/discord/oauth2/token":
+            code = dict(pair.split("=", 1) for pair in body.decode().split("&")).get("code", "")
+            self._send(200, {"access_token": f"token-{code}", "token_type": "Bearer"})
+        else:
+            self._send(404, {})
+
+    def do_GET(self):
+        if self._delay_or_fail():
+            return
+        if self.path.startswith("/session/session/minecraft/profile/"):
+            uuid = self.path.rsplit("/", 1)[1]
+            self._send(200, {"id": uuid, "name": uuid[:16]})
+        elif self.path == "/discord/users/@me":
+            token = self.headers.get("Authorization", "")
+            self._send(200, {"id": fake_discord_id(token)})
+        elif self.path.startswith("/avatars/"):
+            from avatars import encode_png
+            self._send(200, encode_png(64, 64, [b"\x80\x40\x20\xff" * 64] * 64), "image/png")
+        else:
+            self._send(404, {})
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream(latency_ms, error_rate):
+    UpstreamHandler.latency = latency_ms / 1000
+    UpstreamHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="upstream-stub", daemon=True).start()
+    return server
+
+
+# --- Setup ---
+def prepare_environment(workdir, upstream_port):
+    """Point the app at the stubs and a scratch database; must run before importing it."""
+    base = f"http://127.0.0.1:{upstream_port}"
+    os.environ.update({
+        "MOJANG_API_URL": f"{base}/mojang",
+        "MOJANG_SESSION_URL": f"{base}/session",
+        "DISCORD_API_URL": f"{base}/discord",
+        "AVATAR_SOURCE_URL": f"{base}/avatars/{{uuid}}",
+        "DWP_NOTIFY_SOCKET": os.path.join(workdir, "notify.sock"),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+
+
+def seed_database(players, warm_fraction):
+    from database import set_value, cache_player_skins
+    from db_tool import import_records
+
+    for key, value in (("client_id", "1234"), ("secret", "bench-secret"), ("domain", "bench.invalid")):
+        set_value(key, value)
+    names = [f"Player{i}" for i in range(players)]
+    import_records(("links", {"discord_id": fake_discord_id(name), "minecraft_name": name}) for name in names)
+    warm = names[:int(players * warm_fraction)]
+    for start in range(0, len(warm), 1000):
+        cache_player_skins({name: {"uuid": fake_uuid(name), "name": name} for name in warm[start:start + 1000]})
+
+
+# --- Load generation ---
+def make_request(client, endpoint, i, run_id):
+    headers = {"Accept-Encoding": "gzip"}
+    if endpoint == "index":
+        return client.get("/", headers=headers)
+    if endpoint == "whitelist":
+        return client.get(f"/whitelist?code={fake_discord_id(str(i))}", headers=headers)
+    if endpoint == "callback":
+        return client.get(f"/callback?code=bench{run_id}-{i}", headers=headers)
+    if endpoint == "submit":
+        # Fresh applicant and address each time, so rate limits and dedupe don't kick in
+        return client.post("/submit", headers=headers, environ_base={"REMOTE_ADDR": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"},
+                           json={"code": fake_discord_id(f"applicant-{run_id}-{i}"), "in_game_name": f"New{run_id % 1000}_{i}"[:16]})
+    if endpoint == "players":
+        return client.get("/api/whitelisted-players", headers=headers)
+    if endpoint == "players_page":
+        return client.get("/api/whitelisted-players?limit=100", headers=headers)
+    raise ValueError(endpoint)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_endpoint(app, endpoint, requests, concurrency, run_id):
+    from database import get_db_stats
+    from http_client import client as http
+
+    stats = get_db_stats()
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        response = make_request(local.client, endpoint, i, run_id)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        with results_lock:
+            results.append((elapsed, response.status_code))
+
+    upstream_before = http.stats()
+    # Process-wide, so writes made for a request on another thread (the
+    # application group commit) are counted too
+    db_before = stats.snapshot()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    db_after = stats.snapshot()
+    upstream_after = http.stats()
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r[1] >= 400),
+        "status_counts": statuses,
+        "throughput_rps": round(len(results) / wall, 1) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(latencies[-1], 2),
+            "mean": round(sum(latencies) / len(latencies), 2),
+        },
+        "db": {
+            "reads_per_request": round((db_after["reads"] - db_before["reads"]) / len(results), 2),
+            "writes_per_request": round((db_after["writes"] - db_before["writes"]) / len(results), 2),
+            "transactions": db_after["transactions"] - db_before["transactions"],
+            "connections_opened": db_after["opens"] - db_before["opens"],
+        },
+        "upstream_calls": {
+            host: data["requests"] - upstream_before.get(host, {}).get("requests", 0)
+            for host, data in upstream_after.items()
+            if data["requests"] != upstream_before.get(host, {}).get("requests", 0)
+        },
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Regression messages: p95 slower or throughput lower than baseline by more than tolerance."""
+    problems = []
+    for endpoint, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        if current["latency_ms"]["p95"] > previous["latency_ms"]["p95"] * (1 + tolerance):
+            problems.append(f"{endpoint}: p95 {previous['latency_ms']['p95']}ms -> {current['latency_ms']['p95']}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{endpoint}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the web app against stubbed upstreams.")
+    parser.add_argument("--players", type=int, default=1000, help="Links to seed (e.g. 100 to 50000)")
+    parser.add_argument("--warm-cache", type=float, default=1.0, help="Fraction of players already in the skin cache")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--upstream-latency", type=float, default=50, help="Mean stub latency in ms")
+    parser.add_argument("--upstream-errors", type=float, default=0.0, help="Fraction of stub calls answered with 503")
+    parser.add_argument("--workdir", help="Scratch directory for the database (default: a new temp dir)")
+    parser.add_argument("-o", "--output", default="-", help="Where to write the JSON report ('-' for stdout)")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+    output = os.path.abspath(args.output) if args.output != "-" else "-"
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    upstream = start_upstream(args.upstream_latency, args.upstream_errors)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dwp-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    prepare_environment(workdir, upstream.server_port)
+
+    started = time.perf_counter()
+    seed_database(args.players, args.warm_cache)
+    print(f"Seeded {args.players} players in {time.perf_counter() - started:.1f}s ({workdir})", file=sys.stderr)
+
+    import webapp
+    webapp.SUBMIT_QUEUE_LIMIT = sys.maxsize # Measure the submit path, not load shedding
+    run_id = int(time.time())
+    result = {
+        "config": {k: getattr(args, k) for k in ("players", "warm_cache", "concurrency", "requests", "upstream_latency", "upstream_errors")},
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        make_request(webapp.app.test_client(), endpoint, -1, run_id) # Warm caches outside the measurement
+        result["endpoints"][endpoint] = run_endpoint(webapp.app, endpoint, args.requests, args.concurrency, run_id)
+        summary = result["endpoints"][endpoint]
+        print(f"{endpoint}: p50 {summary['latency_ms']['p50']}ms p99 {summary['latency_ms']['p99']}ms "
+              f"{summary['throughput_rps']} req/s", file=sys.stderr)
+    result["upstream_stub_calls"] = dict(UpstreamHandler.calls)
+
+    report = json.dumps(result, indent=2)
+    if output == "-":
+        print(report)
+    else:
+        with open(output, "w") as f:
+            f.write(report + "\n")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# build_assets.py
+# Build step for static files. Every image in static/ is resized to a few
+# responsive widths and recompressed as AVIF, WebP and its original format;
+# other files are copied as-is. Output names carry a content hash, so the
+# web app can serve them with one-year immutable caching.
+#
+#   python build_assets.py            # writes static/build/ and its manifest
+#   python build_assets.py --clean    # also removes outputs no longer referenced
+#
+# Requires Pillow (pip install Pillow). Run it again whenever static/ changes;
+# the web app picks up the new manifest without a restart.
+import os
+import sys
+import json
+import hashlib
+import argparse
+import shutil
+from io import BytesIO
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+STATIC_DIR = "static"
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+MANIFEST_FILE = os.path.join(BUILD_DIR, "manifest.json")
+ASSET_WIDTHS = (480, 960, 1920) # Responsive widths; never upscaled beyond the original
+IMAGE_EXTENSIONS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+HASH_LENGTH = 12
+
+# format -> (file extension, MIME type, Pillow save options)
+FORMATS = {
+    "avif": ("avif", "image/avif", {"quality": 55}),
+    "webp": ("webp", "image/webp", {"quality": 80, "method": 6}),
+    "PNG": ("png", "image/png", {"optimize": True}),
+    "JPEG": ("jpg", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def write_output(stem, data, extension, width=None):
+    """Write data under a content-hashed name; returns its path relative to static/."""
+    suffix = f"-{width}w" if width else ""
+    name = f"{stem}{suffix}.{content_hash(data)}.{extension}"
+    path = os.path.join(BUILD_DIR, name)
+    if not os.path.exists(path): # Same hash, same bytes
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+    return f"build/{name}"
+
+
+def encode(image, fmt):
+    _, _, options = FORMATS[fmt]
+    if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = BytesIO()
+    image.save(out, format=fmt.upper(), **options)
+    return out.getvalue()
+
+
+def available_formats(original_format):
+    formats = []
+    if features.check("avif"):
+        formats.append("avif")
+    if features.check("webp"):
+        formats.append("webp")
+    return formats + [original_format]
+
+
+def build_image(filename, source_path):
+    stem, ext = os.path.splitext(filename)
+    original_format = IMAGE_EXTENSIONS[ext.lower()]
+    with Image.open(source_path) as source:
+        source.load()
+    widths = sorted({w for w in ASSET_WIDTHS if w < source.width} | {source.width})
+
+    variants = []
+    for width in widths:
+        if width == source.width:
+            image = source
+        else:
+            height = round(source.height * width / source.width)
+            image = source.resize((width, height), Image.LANCZOS)
+        for fmt in available_formats(original_format):
+            extension, mime, _ = FORMATS[fmt]
+            path = write_output(stem, encode(image, fmt), extension, width)
+            variants.append({"path": path, "width": width, "type": mime})
+
+    # The plain URL points at the full-width file in the original format
+    fallback = [v for v in variants if v["width"] == source.width and v["type"] == FORMATS[original_format][1]][0]
+    return {"path": fallback["path"], "width": source.width, "height": source.height, "variants": variants}
+
+
+def build_file(filename, source_path):
+    stem, ext = os.path.splitext(filename)
+    with open(source_path, "rb") as f:
+        data = f.read()
+    return {"path": write_output(stem, data, ext.lstrip(".")), "variants": []}
+
+
+def build(clean=False):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest = {}
+    for filename in sorted(os.listdir(STATIC_DIR)):
+        source_path = os.path.join(STATIC_DIR, filename)
+        if not os.path.isfile(source_path):
+            continue
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+            entry = build_image(filename, source_path)
+        else:
+            entry = build_file(filename, source_path)
+        manifest[filename] = entry
+        outputs = [v["path"] for v in entry["variants"]] or [entry["path"]]
+        smallest = min(os.path.getsize(os.path.join(STATIC_DIR, path)) for path in outputs)
+        print(f"{filename}: {os.path.getsize(source_path)} bytes -> {len(outputs)} files, smallest {smallest} bytes")
+
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+    if clean:
+        referenced = {os.path.basename(MANIFEST_FILE)}
+        for entry in manifest.values():
+            referenced.add(os.path.basename(entry["path"]))
+            referenced.update(os.path.basename(v["path"]) for v in entry["variants"])
+        for name in os.listdir(BUILD_DIR):
+            if name not in referenced:
+                path = os.path.join(BUILD_DIR, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+                print(f"Removed stale {name}")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build hashed, recompressed static assets.")
+    parser.add_argument("--clean", action="store_true", help="Remove build outputs the new manifest no longer references")
+    args = parser.parse_args(argv)
+    if Image is None:
+        sys.exit("build_assets.py needs Pillow: pip install Pillow")
+    manifest = build(clean=args.clean)
+    print(f"Wrote {MANIFEST_FILE} ({len(manifest)} assets).")
+
+
+if __name__ == "__main__":
+    main()
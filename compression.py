@@ -0,0 +1,80 @@
+# compression.py
+# Bodies that are served many times (rendered pages, the players JSON) are
+# compressed once when they are built and kept alongside the plain bytes.
+# respond() picks the variant the client accepts, so a request costs a dict
+# lookup instead of a Jinja render plus on-the-fly compression.
+import os
+import gzip
+import hashlib
+import threading
+
+from flask import current_app, render_template, request
+
+try:
+    import brotli
+except ImportError: # Optional; gzip covers every browser
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+MIN_COMPRESS_SIZE = 512 # Smaller bodies aren't worth the header overhead
+
+
+class CompressedBody:
+    """One body plus its precompressed variants, keyed by Content-Encoding."""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    def choose(self, accept_encodings):
+        """(encoding, bytes) for the smallest variant the client accepts; encoding None means identity."""
+        best = (None, self.body)
+        for encoding, data in self.variants.items():
+            if accept_encodings[encoding] and len(data) < len(best[1]):
+                best = (encoding, data)
+        return best
+
+
+def respond(compressed, mimetype, cache_control=None):
+    encoding, data = compressed.choose(request.accept_encodings)
+    response = current_app.response_class(data, mimetype=mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    # Each encoding is a different representation, so it gets its own ETag
+    response.set_etag(f"{compressed.etag}-{encoding}" if encoding else compressed.etag)
+    response.vary.add("Accept-Encoding")
+    if cache_control:
+        response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(request) # 304 when If-None-Match matches
+
+
+class PageCache:
+    """
+    Rendered templates that take no per-request context. An entry is rebuilt
+    when its template file changes or when the version passed in changes
+    (e.g. the asset manifest the page links to).
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_name, version=None):
+        path = os.path.join(current_app.root_path, current_app.template_folder, template_name)
+        key = (os.path.getmtime(path), version)
+        cached = self._pages.get(template_name)
+        if cached and cached[0] == key:
+            return cached[1]
+        with self._lock:
+            cached = self._pages.get(template_name)
+            if cached and cached[0] == key:
+                return cached[1]
+            compressed = CompressedBody(render_template(template_name).encode())
+            self._pages[template_name] = (key, compressed)
+            return compressed
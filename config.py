@@ -0,0 +1,104 @@
+# config.py
+import time
+import threading
+from dataclasses import dataclass, field
+
+import database
+from database import get_backend, CONFIG_KEYS, CONFIG_VERSION_KEY
+
+CONFIG_RECHECK_SECONDS = 2 # How often to look for writes made by the other service
+
+
+def _as_int(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Typed snapshot of the bot/webapp configuration stored in the database."""
+    token: str = None
+    secret: str = None
+    client_id: str = None
+    domain: str = None
+    guild: int = None
+    channel: int = None
+    role: int = None
+    chat_channel_id: int = None
+    intro_channel_id: int = None
+    whitelist: str = None
+    rcon_host: str = None
+    rcon_port: int = None
+    rcon_password: str = None
+    managed_roles: list = field(default_factory=list)
+
+    @classmethod
+    def from_store(cls, raw):
+        return cls(
+            token=raw.get("token"),
+            secret=raw.get("secret"),
+            client_id=raw.get("client_id"),
+            domain=raw.get("domain"),
+            guild=_as_int(raw.get("guild")),
+            channel=_as_int(raw.get("channel")),
+            role=_as_int(raw.get("role")),
+            chat_channel_id=_as_int(raw.get("chat_channel_id")),
+            intro_channel_id=_as_int(raw.get("intro_channel_id")),
+            whitelist=raw.get("whitelist"),
+            rcon_host=raw.get("rcon_host"),
+            rcon_port=_as_int(raw.get("rcon_port")),
+            rcon_password=raw.get("rcon_password"),
+            managed_roles=[int(r) for r in raw.get("managed_roles") or []],
+        )
+
+
+class Config:
+    """
+    Process-local config cache. Reads come from memory; the snapshot is reloaded
+    when this process writes a config key (set_value bumps a local generation)
+    or when the shared config_version row changes because the other service wrote.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = None
+        self._version = None
+        self._generation = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def current(self):
+        now = time.monotonic()
+        settings = self._settings
+        if settings is not None and self._generation == database.config_generation:
+            if now - self._checked_at < CONFIG_RECHECK_SECONDS:
+                self.hits += 1
+                return settings
+            self._checked_at = now
+            if get_backend().get_kv(CONFIG_VERSION_KEY) == self._version:
+                self.hits += 1
+                return settings
+        return self._reload(now)
+
+    def _reload(self, now):
+        with self._lock:
+            backend = get_backend()
+            generation = database.config_generation
+            self._settings = Settings.from_store(backend.get_many_kv(CONFIG_KEYS))
+            self._version = backend.get_kv(CONFIG_VERSION_KEY)
+            self._generation = generation
+            self._checked_at = now
+            self.misses += 1
+            return self._settings
+
+    def invalidate(self):
+        self._settings = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+config = Config()
@@ -1,20 +1,249 @@
 # database.py
-import shelve
+import os
+import sys
 import json
 import time
+import threading
+from collections import OrderedDict
+
+from storage import BACKENDS
+from metrics import PLAYER_CACHE_LOOKUPS
 
 APPLICATIONS_KEY = "applications"
 PLAYER_CACHE_KEY = "player_cache"
 PLAYER_CACHE_TIME = 3600  # Cache time in seconds (1 hour)
 DB_FILE = 'mydb' # Ensure this path is accessible by both services
+SQLITE_FILE = f"{DB_FILE}.sqlite3" # Record-level store; the old shelve file is imported on first open
+DB_BACKEND = os.environ.get("DWP_DB_BACKEND", "sqlite")
+
+# Keys read through config.Config. Writing one of them bumps CONFIG_VERSION_KEY so
+# the other service notices, and config_generation so this process does at once.
+CONFIG_KEYS = (
+    "token", "secret", "client_id", "domain", "guild", "channel", "role",
+    "chat_channel_id", "intro_channel_id", "whitelist",
+    "rcon_host", "rcon_port", "rcon_password", "managed_roles",
+)
+CONFIG_VERSION_KEY = "config_version"
+config_generation = 0
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Return the process-wide storage backend, opening it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = BACKENDS[DB_BACKEND](SQLITE_FILE, legacy_shelve_file=DB_FILE)
+    return _backend
+
+def get_db_stats():
+    """Counters and timings for this process's database work (see storage.DBStats)."""
+    return get_backend().stats
 
 def set_value(key, value):
-    with shelve.open(DB_FILE) as db:
-        db[key] = value
+    global config_generation
+    backend = get_backend()
+    if key in CONFIG_KEYS:
+        with backend.transaction():
+            backend.set_value(key, value)
+            backend.set_kv(CONFIG_VERSION_KEY, (backend.get_kv(CONFIG_VERSION_KEY) or 0) + 1)
+        config_generation += 1
+    else:
+        backend.set_value(key, value)
 
 def get_value(key):
-    with shelve.open(DB_FILE) as db:
-        return db.get(key)
+    return get_backend().get_value(key)
+
+def transaction():
+    """
+    Context manager grouping several helper calls into one atomic write, e.g.
+        with transaction():
+            remove_link(old_id)
+            set_link(new_id, name)
+    """
+    return get_backend().transaction()
+
+def update(key, fn):
+    """
+    Atomically replace get_value(key) with fn(current_value) and return the new
+    value. Safe against concurrent writers in other processes.
+    """
+    with transaction():
+        value = fn(get_value(key))
+        set_value(key, value)
+        return value
+
+def get_change_version(name):
+    """Current write counter for a table tracked in change_counters (e.g. "links")."""
+    row = get_backend().execute("SELECT version FROM change_counters WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+# --- Links (Discord ID -> Minecraft name) ---
+def get_links():
+    return get_value("links") or {}
+
+def get_link(discord_id):
+    row = get_backend().execute(
+        "SELECT minecraft_name FROM links WHERE discord_id = ?", (str(discord_id),)
+    ).fetchone()
+    return row[0] if row else None
+
+def set_link(discord_id, minecraft_name, uuid=None):
+    """
+    Create or update a link. Without a uuid an existing one is kept while the
+    name stays the same (case-insensitively) and cleared when it changes, so
+    name_tracker resolves the new name.
+    """
+    get_backend().execute(
+        "INSERT INTO links (discord_id, minecraft_name, uuid) VALUES (?, ?, ?) "
+        "ON CONFLICT(discord_id) DO UPDATE SET minecraft_name = excluded.minecraft_name, uuid = CASE "
+        "WHEN excluded.uuid IS NOT NULL THEN excluded.uuid "
+        "WHEN links.minecraft_name = excluded.minecraft_name COLLATE NOCASE THEN links.uuid END",
+        (str(discord_id), minecraft_name, uuid),
+    )
+
+def get_link_uuid(discord_id):
+    row = get_backend().execute("SELECT uuid FROM links WHERE discord_id = ?", (str(discord_id),)).fetchone()
+    return row[0] if row else None
+
+def remove_link(discord_id):
+    """Remove one link. Returns the Minecraft name it pointed to, or None."""
+    with get_backend().transaction() as conn:
+        row = conn.execute("SELECT minecraft_name FROM links WHERE discord_id = ?", (str(discord_id),)).fetchone()
+        if row:
+            conn.execute("DELETE FROM links WHERE discord_id = ?", (str(discord_id),))
+        return row[0] if row else None
+
+def relink(discord_id, minecraft_name, uuid=None):
+    """
+    Point discord_id at minecraft_name, dropping any other link that already uses
+    that name (or, when given, that UUID under an older name). Returns
+    (previous_name, displaced_discord_id), either may be None.
+    """
+    discord_id = str(discord_id)
+    with transaction():
+        displaced_id = None
+        existing = find_links_by_name(minecraft_name)
+        if uuid:
+            existing += get_backend().execute(
+                "SELECT discord_id, minecraft_name FROM links WHERE uuid = ?", (uuid,)
+            ).fetchall()
+        for existing_id, _ in existing:
+            if existing_id != discord_id and existing_id != displaced_id:
+                displaced_id = existing_id
+                remove_link(existing_id)
+        previous_name = get_link(discord_id)
+        set_link(discord_id, minecraft_name, uuid)
+    return previous_name, displaced_id
+
+def find_links_by_name(minecraft_name):
+    """
+    Return [(discord_id, minecraft_name)] for links matching the name case-insensitively.
+    Served by the idx_links_name_id index; see name_index.py for prefix and fuzzy lookups.
+    """
+    return get_backend().execute(
+        "SELECT discord_id, minecraft_name FROM links WHERE minecraft_name = ? COLLATE NOCASE",
+        (minecraft_name,),
+    ).fetchall()
+
+def get_links_page(after=None, limit=None, prefix=None):
+    """
+    Links ordered by Minecraft name (case-insensitively, then Discord ID), as
+    [(discord_id, minecraft_name, uuid)]. after is the (minecraft_name, discord_id)
+    of the last row of the previous page; prefix keeps names starting with it.
+    Walks the idx_links_name_id index, so a page costs the same at any offset.
+    """
+    clauses, params = [], []
+    if after is not None:
+        clauses.append("(minecraft_name COLLATE NOCASE, discord_id) > (?, ?)")
+        params.extend(after)
+    if prefix:
+        # NOCASE compares lowercased ASCII, so bump the last character of the lowercased prefix for the upper bound.
+        # The highest code point can't be bumped; bump the character before it (no bound if there is none).
+        lower = prefix.lower()
+        clauses.append("minecraft_name >= ? COLLATE NOCASE")
+        params.append(lower)
+        bumpable = lower.rstrip(chr(sys.maxunicode))
+        if bumpable:
+            clauses.append("minecraft_name < ? COLLATE NOCASE")
+            params.append(bumpable[:-1] + chr(ord(bumpable[-1]) + 1))
+    sql = "SELECT discord_id, minecraft_name, uuid FROM links"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY minecraft_name COLLATE NOCASE, discord_id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return get_backend().execute(sql, params).fetchall()
+
+def remove_links_by_name(minecraft_name):
+    """Remove every link pointing at this Minecraft name. Returns the removed Discord IDs."""
+    with get_backend().transaction() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT discord_id FROM links WHERE minecraft_name = ? COLLATE NOCASE", (minecraft_name,)
+        )]
+        conn.executemany("DELETE FROM links WHERE discord_id = ?", [(i,) for i in ids])
+    return ids
+
+# --- Link identities (kept current by name_tracker.py) ---
+def get_links_due_for_name_check(checked_before, limit):
+    """
+    Links never checked or last checked before checked_before, least recently
+    checked first: [(discord_id, minecraft_name, uuid)]. uuid may be None.
+    """
+    return get_backend().execute(
+        "SELECT discord_id, minecraft_name, uuid FROM links "
+        "WHERE name_checked_at IS NULL OR name_checked_at < ? "
+        "ORDER BY name_checked_at IS NOT NULL, name_checked_at LIMIT ?",
+        (checked_before, limit),
+    ).fetchall()
+
+def record_link_identity(discord_id, minecraft_name, uuid):
+    """
+    Store what Mojang reported for a link. Only writes the name and uuid when
+    they changed, so unchanged links don't touch the roster or cached lists;
+    a new name shows up as a rename on the live roster stream.
+    """
+    with transaction() as conn:
+        conn.execute("UPDATE links SET name_checked_at = ? WHERE discord_id = ?", (time.time(), str(discord_id)))
+        conn.execute(
+            "UPDATE links SET minecraft_name = ?, uuid = ? WHERE discord_id = ? "
+            "AND (minecraft_name IS NOT ? OR uuid IS NOT ?)",
+            (minecraft_name, uuid, str(discord_id), minecraft_name, uuid),
+        )
+
+def mark_links_name_checked(discord_ids):
+    """Push back the next check for links Mojang had no answer for."""
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE links SET name_checked_at = ? WHERE discord_id = ?",
+            [(time.time(), str(discord_id)) for discord_id in discord_ids],
+        )
+
+# --- Roster events (filled by triggers on links; see storage.SCHEMA) ---
+ROSTER_EVENTS_KEEP = 7 * 24 * 3600 # Seconds of history kept for clients resuming a stream
+
+def get_roster_events(after_id, limit=500):
+    """Roster changes with id > after_id, oldest first, as dicts."""
+    rows = get_backend().execute(
+        "SELECT id, kind, discord_id, name, old_name FROM roster_events WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit),
+    ).fetchall()
+    return [
+        {"id": row[0], "type": row[1], "discord_id": row[2], "name": row[3], **({"old_name": row[4]} if row[4] else {})}
+        for row in rows
+    ]
+
+def get_roster_event_bounds():
+    """(oldest id still stored, newest id); (None, 0) while there are none."""
+    oldest, newest = get_backend().execute("SELECT MIN(id), MAX(id) FROM roster_events").fetchone()
+    return oldest, newest or 0
+
+def prune_roster_events():
+    cursor = get_backend().execute("DELETE FROM roster_events WHERE created_at < ?", (time.time() - ROSTER_EVENTS_KEEP,))
+    return cursor.rowcount
 
 # --- user flags/notes ---
 from datetime import datetime
@@ -22,78 +251,304 @@ from datetime import datetime
 def get_all_user_flags():
     """Get all users who have flags set."""
     try:
-        with shelve.open(DB_FILE) as db:
-            user_flags = db.get("user_flags", {})
-            # Only return users who actually have flags set (not None)
-            return {user_id: flag for user_id, flag in user_flags.items() if flag is not None}
+        return dict(get_backend().execute("SELECT user_key, flag FROM user_flags"))
     except Exception as e:
         print(f"Error getting all user flags: {e}")
         return {}
 
-def get_user_notes(user_identifier):
-    """Get notes for a user by IGN or Discord ID"""
-    notes = get_value("user_notes") or {}
-    return notes.get(str(user_identifier), [])
+def get_user_notes(user_identifier, offset=0, limit=None):
+    """Get notes for a user by IGN or Discord ID, oldest first. Use offset/limit to page."""
+    rows = get_backend().execute(
+        "SELECT note, author, timestamp FROM user_notes WHERE user_key = ? ORDER BY id LIMIT ? OFFSET ?",
+        (str(user_identifier), -1 if limit is None else limit, offset),
+    )
+    return [{"note": note, "author": author, "timestamp": timestamp} for note, author, timestamp in rows]
+
+def count_user_notes(user_identifier):
+    return get_backend().execute(
+        "SELECT COUNT(*) FROM user_notes WHERE user_key = ?", (str(user_identifier),)
+    ).fetchone()[0]
+
+def _fts_term(term):
+    """Quote a search word so it can't be parsed as FTS syntax, keeping a trailing * as a prefix match."""
+    word = term.rstrip("*")
+    quoted = '"%s"' % word.replace('"', '""')
+    return quoted + "*" if word != term else quoted
+
+def search_notes(query, offset=0, limit=10):
+    """
+    Search note text across all users, best match first. Words match whole
+    words; end one with * to match words starting with it (grief* finds
+    "griefing"). Returns (notes, total) where each note also carries its user_key.
+    """
+    backend = get_backend()
+    terms = [term for term in query.split() if term.rstrip("*")]
+    if not terms:
+        return [], 0
+    if backend.has_fts:
+        match = " ".join(_fts_term(term) for term in terms)
+        total = backend.execute(
+            "SELECT COUNT(*) FROM user_notes_fts WHERE user_notes_fts MATCH ?", (match,)
+        ).fetchone()[0]
+        rows = backend.execute(
+            "SELECT n.user_key, n.note, n.author, n.timestamp FROM user_notes_fts "
+            "JOIN user_notes n ON n.id = user_notes_fts.rowid "
+            "WHERE user_notes_fts MATCH ? ORDER BY bm25(user_notes_fts), n.id DESC LIMIT ? OFFSET ?",
+            (match, limit, offset),
+        )
+    else:
+        where = " AND ".join("note LIKE ?" for _ in terms)
+        params = [f"%{term.rstrip('*')}%" for term in terms] # Substring match already covers prefixes
+        total = backend.execute(f"SELECT COUNT(*) FROM user_notes WHERE {where}", params).fetchone()[0]
+        rows = backend.execute(
+            f"SELECT user_key, note, author, timestamp FROM user_notes WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )
+    notes = [
+        {"user_key": user_key, "note": note, "author": author, "timestamp": timestamp}
+        for user_key, note, author, timestamp in rows
+    ]
+    return notes, total
 
 def add_user_note(user_identifier, note, author):
     """Add a note for a user"""
-    notes = get_value("user_notes") or {}
-    user_key = str(user_identifier)
-    if user_key not in notes:
-        notes[user_key] = []
-    
-    note_entry = {
-        "note": note,
-        "author": author,
-        "timestamp": datetime.now().isoformat()
-    }
-    notes[user_key].append(note_entry)
-    set_value("user_notes", notes)
+    get_backend().execute(
+        "INSERT INTO user_notes (user_key, note, author, timestamp) VALUES (?, ?, ?, ?)",
+        (str(user_identifier), note, author, datetime.now().isoformat()),
+    )
 
 def get_user_flag(user_identifier):
     """Get flag status for a user"""
-    flags = get_value("user_flags") or {}
-    return flags.get(str(user_identifier))
+    row = get_backend().execute(
+        "SELECT flag FROM user_flags WHERE user_key = ?", (str(user_identifier),)
+    ).fetchone()
+    return row[0] if row else None
 
 def set_user_flag(user_identifier, flag_type):
     """Set flag for a user (positive, negative, or None to remove)"""
-    flags = get_value("user_flags") or {}
     user_key = str(user_identifier)
     if flag_type is None:
-        flags.pop(user_key, None)
+        get_backend().execute("DELETE FROM user_flags WHERE user_key = ?", (user_key,))
     else:
-        flags[user_key] = flag_type
-    set_value("user_flags", flags)
+        get_backend().execute(
+            "INSERT INTO user_flags (user_key, flag) VALUES (?, ?) "
+            "ON CONFLICT(user_key) DO UPDATE SET flag = excluded.flag",
+            (user_key, flag_type),
+        )
 
 # --- Application Specific Helpers ---
 def get_applications():
-    return json.loads(get_value(APPLICATIONS_KEY) or '{}')
+    rows = get_backend().execute("SELECT message_id, data FROM applications")
+    return {message_id: json.loads(data) for message_id, data in rows}
 
 def save_applications(applications):
     set_value(APPLICATIONS_KEY, json.dumps(applications))
 
+def save_application(message_id, app_data):
+    get_backend().execute(
+        "INSERT INTO applications (message_id, data) VALUES (?, ?) "
+        "ON CONFLICT(message_id) DO UPDATE SET data = excluded.data",
+        (str(message_id), json.dumps(app_data)),
+    )
+
+def remove_application(message_id):
+    """Remove a processed application. Returns True if it was still stored."""
+    cursor = get_backend().execute("DELETE FROM applications WHERE message_id = ?", (str(message_id),))
+    return cursor.rowcount > 0
+
+# --- Application Queue ---
+# Submissions are appended to the application_queue table. The bot leases the
+# oldest visible entry, posts it and then acks it; an entry that is not acked
+# within the visibility timeout (bot crashed, Discord error) is delivered again.
+QUEUE_VISIBILITY_TIMEOUT = 300 # Seconds a leased application stays hidden
+QUEUE_MAX_ATTEMPTS = 5 # Deliveries before an application is dead-lettered
+GROUP_COMMIT_WINDOW = 0.005 # Seconds concurrent submissions wait to share one commit
+
+def add_applications_to_queue(apps):
+    """Append several applications in a single transaction."""
+    get_backend().enqueue(apps)
+
+class _GroupCommitQueue:
+    """
+    Batches add_application_to_queue calls from concurrent request threads into
+    one transaction. Callers still block until their own entry is committed.
+    """
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+
+    def submit(self, app_data, timeout=10):
+        entry = {"data": app_data, "done": threading.Event(), "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="queue-group-commit", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if not entry["done"].wait(timeout):
+            with self._cond:
+                waiting = entry in self._pending
+                if waiting:
+                    self._pending.remove(entry)
+            if waiting:
+                raise TimeoutError("Timed out waiting for application queue commit")
+            # The writer already has it in a batch; report how that batch ended
+            entry["done"].wait()
+        if entry["error"]:
+            raise entry["error"]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.window) # Let concurrent submissions join this batch
+            with self._cond:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            try:
+                add_applications_to_queue([entry["data"] for entry in batch])
+            except Exception as e:
+                print(f"Error committing application batch: {e}")
+                for entry in batch:
+                    entry["error"] = e
+            for entry in batch:
+                entry["done"].set()
+
+_group_commit = _GroupCommitQueue()
+
 def add_application_to_queue(app_data):
     """
-    Adds application data to a list in shelve that the bot will process.
-    This simulates the old queue behavior.
+    Adds application data to the queue the bot processes.
+    Concurrent calls are committed together.
+    """
+    _group_commit.submit(app_data)
+
+def lease_application(visibility_timeout=QUEUE_VISIBILITY_TIMEOUT):
+    """
+    Takes the oldest visible application and hides it for visibility_timeout
+    seconds. Returns (item_id, app_data), or None if nothing is waiting.
+    The caller must ack_application(item_id) once it has been handled.
+    """
+    backend = get_backend()
+    while True:
+        now = time.time()
+        row = backend.execute(
+            "UPDATE application_queue SET visible_at = ?, attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM application_queue WHERE visible_at <= ? ORDER BY visible_at, id LIMIT 1) "
+            "RETURNING id, payload, attempts",
+            (now + visibility_timeout, now),
+        ).fetchone()
+        if row is None:
+            return None
+        item_id, payload, attempts = row
+        if attempts > QUEUE_MAX_ATTEMPTS:
+            dead_letter_application(item_id, f"Gave up after {QUEUE_MAX_ATTEMPTS} delivery attempts")
+            continue
+        return item_id, json.loads(payload)
+
+def ack_application(item_id):
+    """Remove a leased application from the queue once it has been handled."""
+    get_backend().execute("DELETE FROM application_queue WHERE id = ?", (item_id,))
+
+def release_application(item_id, delay=0):
+    """Give a leased application back so it is delivered again after delay seconds."""
+    get_backend().execute(
+        "UPDATE application_queue SET visible_at = ? WHERE id = ?", (time.time() + delay, item_id)
+    )
+
+def dead_letter_application(item_id, reason):
+    """Move a queued application to the dead-letter table so it is kept but not retried."""
+    with get_backend().transaction() as conn:
+        row = conn.execute("SELECT payload, attempts FROM application_queue WHERE id = ?", (item_id,)).fetchone()
+        if not row:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO application_dead_letter (id, payload, reason, attempts, failed_at) VALUES (?, ?, ?, ?, ?)",
+            (item_id, row[0], reason, row[1], time.time()),
+        )
+        conn.execute("DELETE FROM application_queue WHERE id = ?", (item_id,))
+    print(f"Dead-lettered queued application {item_id}: {reason}")
+
+def get_dead_letter_applications():
+    rows = get_backend().execute(
+        "SELECT id, payload, reason, attempts, failed_at FROM application_dead_letter ORDER BY id"
+    )
+    return [
+        {"id": item_id, "data": json.loads(payload), "reason": reason, "attempts": attempts, "failed_at": failed_at}
+        for item_id, payload, reason, attempts, failed_at in rows
+    ]
+
+def requeue_dead_letter_applications():
+    """Put every dead-lettered application back on the queue. Returns how many were moved."""
+    with get_backend().transaction() as conn:
+        payloads = [json.loads(p) for (p,) in conn.execute("SELECT payload FROM application_dead_letter ORDER BY id")]
+        add_applications_to_queue(payloads)
+        conn.execute("DELETE FROM application_dead_letter")
+    return len(payloads)
+
+def get_queue_depth():
+    return get_backend().execute("SELECT COUNT(*) FROM application_queue").fetchone()[0]
+
+def find_pending_application(discord_id, minecraft_name):
+    """
+    An application by this Discord user or for this Minecraft name that is
+    still waiting (queued, or posted but not yet accepted/rejected), or None.
     """
-    with shelve.open(DB_FILE) as db:
-        pending_apps = db.get("pending_applications_queue", [])
-        pending_apps.append(app_data)
-        db["pending_applications_queue"] = pending_apps
+    row = get_backend().execute(
+        "SELECT payload FROM application_queue "
+        "WHERE CAST(json_extract(payload, '$.code') AS TEXT) = ? OR json_extract(payload, '$.in_game_name') = ? COLLATE NOCASE "
+        "UNION ALL SELECT data FROM applications "
+        "WHERE CAST(json_extract(data, '$.code') AS TEXT) = ? OR json_extract(data, '$.in_game_name') = ? COLLATE NOCASE "
+        "LIMIT 1",
+        (str(discord_id), minecraft_name, str(discord_id), minecraft_name),
+    ).fetchone()
+    return json.loads(row[0]) if row else None
 
 def get_application_from_queue():
     """
     Retrieves and removes the oldest application from the queue.
     Returns None if the queue is empty.
     """
-    with shelve.open(DB_FILE) as db:
-        pending_apps = db.get("pending_applications_queue", [])
-        if not pending_apps:
-            return None
-        app_data = pending_apps.pop(0)
-        db["pending_applications_queue"] = pending_apps
-        return app_data
+    leased = lease_application()
+    if leased is None:
+        return None
+    item_id, app_data = leased
+    ack_application(item_id)
+    return app_data
+
+# --- Rate limiting ---
+# Token buckets live in the database so every gunicorn worker draws from the
+# same bucket. A bucket holds up to `capacity` tokens and regains
+# `refill_per_second`; each allowed call takes one.
+RATE_LIMIT_RETENTION = 24 * 3600 # Buckets untouched this long are dropped by maintenance
+
+def take_token(key, capacity, refill_per_second):
+    """
+    Take a token from the bucket `key`. Returns 0 when allowed, otherwise the
+    number of seconds until a token will be available.
+    """
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_second)
+        if tokens < 1:
+            return (1 - tokens) / refill_per_second
+        conn.execute(
+            "INSERT INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (key, tokens - 1, now),
+        )
+        return 0
+
+def prune_rate_limits():
+    """Drop buckets nobody has used for RATE_LIMIT_RETENTION (they'd be full again anyway)."""
+    cursor = get_backend().execute("DELETE FROM rate_limits WHERE updated_at < ?", (time.time() - RATE_LIMIT_RETENTION,))
+    return cursor.rowcount
 
 # --- Player Cache Specific Helpers ---
 def get_player_cache():
@@ -101,22 +556,209 @@ def get_player_cache():
 
 def save_player_cache(cache):
     set_value(PLAYER_CACHE_KEY, json.dumps(cache))
+    _player_lru.clear()
+
+# Entries are keyed by lowercased username. A row with NULL data records that
+# Mojang has no such player, so unknown names are not looked up on every page load.
+# Hot entries are also kept in a small per-process LRU in front of the table.
+PLAYER_MISSING_CACHE_TIME = 3 * 3600 # How long a "no such player" answer is trusted
+PLAYER_CACHE_LRU_SIZE = 2048
+PLAYER_CACHE_SWEEP_INTERVAL = 600 # Seconds between expiry sweeps of the player cache table
+PLAYER_CACHE_MAX_STALE = 7 * 24 * 3600 # Expired entries are still served (and refreshed in the background) this long
+PLAYER_LRU_RECHECK = 30 # Seconds before a stale in-memory entry is re-read, in case another worker refreshed it
+
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_player_lru = _LRUCache(PLAYER_CACHE_LRU_SIZE)
+_last_player_sweep = 0.0
+
+def _player_entry_expiry(data, timestamp):
+    return timestamp + (PLAYER_CACHE_TIME if data is not None else PLAYER_MISSING_CACHE_TIME)
+
+def peek_player_skin(username):
+    """
+    Returns (state, player_data) without ever calling Mojang. state is "fresh",
+    "stale" (expired but still usable while it is refreshed) or "unknown".
+    player_data None with a fresh/stale state means the player does not exist.
+    """
+    key = username.lower()
+    now = time.time()
+    entry = _player_lru.get(key)
+    if entry is not None and now >= entry[1] and now - entry[2] >= PLAYER_LRU_RECHECK:
+        entry = None # Stale in memory; another worker may have refreshed the row
+    if entry is None:
+        row = get_backend().execute(
+            "SELECT data, timestamp FROM player_cache WHERE username = ?", (key,)
+        ).fetchone()
+        if row is None:
+            PLAYER_CACHE_LOOKUPS.inc(result="unknown")
+            return "unknown", None
+        data = json.loads(row[0]) if row[0] is not None else None
+        entry = (data, _player_entry_expiry(data, row[1]), now)
+        _player_lru.put(key, entry)
+    data, expires_at, _ = entry
+    state = "fresh" if now < expires_at else "stale"
+    PLAYER_CACHE_LOOKUPS.inc(result=state)
+    return state, data
+
+def lookup_player_skin(username):
+    """
+    Returns (cached, player_data). cached is False when nothing fresh is stored;
+    (True, None) means Mojang reported the player does not exist.
+    """
+    state, data = peek_player_skin(username)
+    if state != "fresh":
+        return False, None
+    return True, data
+
+def get_players_due_for_refresh(ahead, limit=1000):
+    """
+    Linked players whose cache entry is missing or expires within `ahead`
+    seconds, soonest first (missing ones first of all): [(name, expires_at)].
+    Links that already store their UUID don't need the cache and are skipped.
+    """
+    now = time.time()
+    rows = get_backend().execute(
+        "SELECT l.minecraft_name, c.timestamp + CASE WHEN c.data IS NULL THEN ? ELSE ? END AS expires_at "
+        "FROM links l LEFT JOIN player_cache c ON c.username = lower(l.minecraft_name) "
+        "WHERE l.uuid IS NULL AND (c.username IS NULL OR expires_at < ?) ORDER BY expires_at LIMIT ?",
+        (PLAYER_MISSING_CACHE_TIME, PLAYER_CACHE_TIME, now + ahead, limit),
+    )
+    return [(name, expires_at if expires_at is not None else 0) for name, expires_at in rows]
+
+def is_known_uuid(uuid):
+    """True if a link or the player cache holds this (dashless, lowercase) UUID."""
+    return get_backend().execute(
+        "SELECT EXISTS (SELECT 1 FROM links WHERE uuid = ?) "
+        "OR EXISTS (SELECT 1 FROM player_cache WHERE json_extract(data, '$.uuid') = ?)",
+        (uuid, uuid),
+    ).fetchone()[0] == 1
 
 def get_cached_player_skin(username):
-    cache = get_player_cache()
-    current_time = time.time()
-    if username in cache and current_time - cache[username]['timestamp'] < PLAYER_CACHE_TIME:
-        return cache[username]['data']
-    return None
+    return lookup_player_skin(username)[1]
+
+def _store_player_entry(username, player_data):
+    key = username.lower()
+    now = time.time()
+    get_backend().execute(
+        "INSERT INTO player_cache (username, data, timestamp) VALUES (?, ?, ?) "
+        "ON CONFLICT(username) DO UPDATE SET data = excluded.data, timestamp = excluded.timestamp",
+        (key, json.dumps(player_data) if player_data is not None else None, now),
+    )
+    _player_lru.put(key, (player_data, _player_entry_expiry(player_data, now), now))
+    _maybe_sweep_player_cache()
 
 def cache_player_skin(username, player_data):
-    cache = get_player_cache()
-    current_time = time.time()
-    if username not in cache: # Ensure 'username' key exists
-        cache[username] = {}
-    cache[username]['data'] = player_data
-    cache[username]['timestamp'] = current_time
-    save_player_cache(cache)
+    _store_player_entry(username, player_data)
+
+def cache_player_missing(username):
+    """Remember that Mojang has no player with this name."""
+    _store_player_entry(username, None)
+
+def cache_player_skins(results):
+    """Store many lookups ({username: player_data or None}) in one write."""
+    with transaction():
+        for username, player_data in results.items():
+            _store_player_entry(username, player_data)
+
+def sweep_player_cache():
+    """
+    Delete player cache rows that expired more than PLAYER_CACHE_MAX_STALE ago
+    (players nobody links to any more). Returns the number removed.
+    """
+    global _last_player_sweep
+    now = time.time()
+    _last_player_sweep = now
+    cursor = get_backend().execute(
+        "DELETE FROM player_cache WHERE timestamp < ? - CASE WHEN data IS NULL THEN ? ELSE ? END",
+        (now - PLAYER_CACHE_MAX_STALE, PLAYER_MISSING_CACHE_TIME, PLAYER_CACHE_TIME),
+    )
+    return cursor.rowcount
+
+def _maybe_sweep_player_cache():
+    if time.time() - _last_player_sweep >= PLAYER_CACHE_SWEEP_INTERVAL:
+        try:
+            removed = sweep_player_cache()
+            if removed:
+                print(f"Swept {removed} expired player cache entries.")
+        except Exception as e:
+            print(f"Error sweeping player cache: {e}")
+
+# --- Maintenance: snapshot + compaction ---
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7 # Number of snapshots kept; older ones are deleted
+
+def snapshot_database(dest_path=None):
+    """Write a consistent copy of the live database. Returns the snapshot path."""
+    if dest_path is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        dest_path = os.path.join(BACKUP_DIR, f"{os.path.basename(SQLITE_FILE)}.{stamp}")
+    get_backend().snapshot(dest_path)
+    return dest_path
+
+def prune_snapshots(keep=BACKUP_KEEP):
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    prefix = f"{os.path.basename(SQLITE_FILE)}."
+    snapshots = sorted(
+        name for name in os.listdir(BACKUP_DIR) if name.startswith(prefix) and not name.endswith(".tmp")
+    )
+    removed = snapshots[:-keep] if keep else snapshots
+    for name in removed:
+        os.remove(os.path.join(BACKUP_DIR, name))
+    return removed
+
+def maintain_database(snapshot=True):
+    """
+    Snapshot then compact the store while both services stay online.
+    Returns a report with sizes before/after, the snapshot path and timing.
+    """
+    backend = get_backend()
+    started = time.time()
+    size_before = backend.size_on_disk()
+    snapshot_path = None
+    if snapshot:
+        snapshot_path = snapshot_database()
+        prune_snapshots()
+    sweep_player_cache()
+    prune_rate_limits()
+    prune_roster_events()
+    backend.compact()
+    report = {
+        "size_before": size_before,
+        "size_after": backend.size_on_disk(),
+        "snapshot": snapshot_path,
+        "seconds": round(time.time() - started, 2),
+    }
+    print(f"Database maintenance finished: {report}")
+    return report
 
 # --- Initial Configuration Setup (Consider moving to a separate setup script) ---
 def initial_setup():
@@ -0,0 +1,225 @@
+# db_tool.py
+# Bulk export/import for the bot database.
+#
+#   python db_tool.py export -o backup.jsonl
+#   python db_tool.py export --format csv -o export_dir --tables links,flags
+#   python db_tool.py import backup.jsonl
+#   python db_tool.py import export_dir/links.csv --table links
+#   python db_tool.py import-whitelist /path/to/server/whitelist.json
+#
+# Rows are streamed in both directions and written in one transaction per chunk,
+# so memory stays flat no matter how many players there are.
+import os
+import csv
+import sys
+import json
+import argparse
+from itertools import islice
+
+from database import get_backend, transaction, cache_player_skin
+
+CHUNK_SIZE = 1000
+
+# table name -> (export query, columns)
+TABLES = {
+    "links": ("SELECT discord_id, minecraft_name, uuid FROM links ORDER BY discord_id", ["discord_id", "minecraft_name", "uuid"]),
+    "notes": ("SELECT user_key, note, author, timestamp FROM user_notes ORDER BY id", ["user_key", "note", "author", "timestamp"]),
+    "flags": ("SELECT user_key, flag FROM user_flags ORDER BY user_key", ["user_key", "flag"]),
+    "applications": ("SELECT message_id, data FROM applications ORDER BY message_id", ["message_id", "data"]),
+}
+
+
+def write_record(conn, table, record):
+    if table == "links":
+        conn.execute(
+            "INSERT INTO links (discord_id, minecraft_name, uuid) VALUES (?, ?, ?) "
+            "ON CONFLICT(discord_id) DO UPDATE SET minecraft_name = excluded.minecraft_name, "
+            "uuid = COALESCE(excluded.uuid, links.uuid)",
+            (str(record["discord_id"]), record["minecraft_name"], record.get("uuid") or None),
+        )
+    elif table == "notes":
+        # Notes are append-only; skip ones already present so re-imports are harmless
+        conn.execute(
+            "INSERT INTO user_notes (user_key, note, author, timestamp) SELECT ?, ?, ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM user_notes WHERE user_key = ? AND note = ? AND timestamp IS ?)",
+            (str(record["user_key"]), record["note"], record.get("author"), record.get("timestamp"),
+             str(record["user_key"]), record["note"], record.get("timestamp")),
+        )
+    elif table == "flags":
+        conn.execute(
+            "INSERT INTO user_flags (user_key, flag) VALUES (?, ?) "
+            "ON CONFLICT(user_key) DO UPDATE SET flag = excluded.flag",
+            (str(record["user_key"]), record["flag"]),
+        )
+    elif table == "applications":
+        data = record["data"]
+        conn.execute(
+            "INSERT INTO applications (message_id, data) VALUES (?, ?) "
+            "ON CONFLICT(message_id) DO UPDATE SET data = excluded.data",
+            (str(record["message_id"]), data if isinstance(data, str) else json.dumps(data)),
+        )
+    else:
+        raise ValueError(f"Unknown table: {table}")
+
+
+def import_records(records, chunk_size=CHUNK_SIZE):
+    """Write (table, record) pairs, committing once per chunk. Returns counts per table."""
+    counts = {}
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        with transaction() as conn:
+            for table, record in chunk:
+                write_record(conn, table, record)
+                counts[table] = counts.get(table, 0) + 1
+        print(f"Imported {sum(counts.values())} records...", file=sys.stderr)
+    return counts
+
+
+# --- export ---
+def iter_table(table):
+    query, columns = TABLES[table]
+    for row in get_backend().execute(query):
+        record = dict(zip(columns, row))
+        if table == "applications":
+            record["data"] = json.loads(record["data"])
+        yield record
+
+
+def export_jsonl(tables, out):
+    count = 0
+    for table in tables:
+        for record in iter_table(table):
+            out.write(json.dumps({"table": table, **record}) + "\n")
+            count += 1
+    return count
+
+
+def export_csv(tables, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    for table in tables:
+        columns = TABLES[table][1]
+        with open(os.path.join(out_dir, f"{table}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for record in iter_table(table):
+                if table == "applications":
+                    record["data"] = json.dumps(record["data"])
+                writer.writerow(record)
+                count += 1
+    return count
+
+
+# --- import ---
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            table = record.pop("table", None)
+            if table not in TABLES:
+                print(f"Line {line_no}: unknown table {table!r}, skipped", file=sys.stderr)
+                continue
+            yield table, record
+
+
+def read_csv(path, table):
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            yield table, record
+
+
+def read_server_whitelist(path):
+    """
+    Links for every player in a Minecraft server whitelist.json that isn't linked
+    yet, using the same manual_<name> convention as /manual_whitelist.
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    linked = {name.lower() for (name,) in get_backend().execute("SELECT minecraft_name FROM links")}
+    for entry in entries:
+        name = entry.get("name")
+        if not name or name.lower() in linked:
+            continue
+        linked.add(name.lower())
+        yield "links", {"discord_id": f"manual_{name}", "minecraft_name": name, "uuid": (entry.get("uuid") or "").replace("-", "").lower()}
+
+
+def seed_player_cache_from_whitelist(path, chunk_size=CHUNK_SIZE):
+    """
+    whitelist.json already carries UUIDs; cache them so the website needn't ask
+    Mojang. Commits once per chunk, like import_records.
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    players = []
+    for entry in entries:
+        uuid = (entry.get("uuid") or "").replace("-", "").lower()
+        if entry.get("name") and uuid:
+            players.append((entry["name"], uuid))
+    for i in range(0, len(players), chunk_size):
+        with transaction():
+            for name, uuid in players[i:i + chunk_size]:
+                cache_player_skin(name, {"uuid": uuid, "name": name})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export/import for the bot database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="Export data to JSONL or CSV")
+    export_parser.add_argument("-o", "--output", default="-", help="Output file (JSONL, '-' for stdout) or directory (CSV)")
+    export_parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    export_parser.add_argument("--tables", default=",".join(TABLES), help=f"Comma-separated subset of: {', '.join(TABLES)}")
+
+    import_parser = sub.add_parser("import", help="Import a JSONL export or one table's CSV")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--table", choices=list(TABLES), help="Table a CSV file belongs to (default: file name)")
+    import_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    whitelist_parser = sub.add_parser("import-whitelist", help="Link every player in a server whitelist.json")
+    whitelist_parser.add_argument("path")
+    whitelist_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+        unknown = [t for t in tables if t not in TABLES]
+        if unknown:
+            parser.error(f"unknown tables: {', '.join(unknown)}")
+        if args.format == "csv":
+            if args.output == "-":
+                parser.error("CSV export needs an output directory (-o)")
+            count = export_csv(tables, args.output)
+        elif args.output == "-":
+            count = export_jsonl(tables, sys.stdout)
+        else:
+            with open(args.output, "w", encoding="utf-8") as out:
+                count = export_jsonl(tables, out)
+        print(f"Exported {count} records.", file=sys.stderr)
+
+    elif args.command == "import":
+        if args.path.endswith(".csv"):
+            table = args.table or os.path.splitext(os.path.basename(args.path))[0]
+            if table not in TABLES:
+                parser.error("pass --table for CSV files not named after a table")
+            records = read_csv(args.path, table)
+        else:
+            records = read_jsonl(args.path)
+        counts = import_records(records, args.chunk_size)
+        print(f"Import finished: {counts}", file=sys.stderr)
+
+    elif args.command == "import-whitelist":
+        counts = import_records(read_server_whitelist(args.path), args.chunk_size)
+        seed_player_cache_from_whitelist(args.path, args.chunk_size)
+        print(f"Linked {counts.get('links', 0)} new players from {args.path}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
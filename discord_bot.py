@@ -1,14 +1,21 @@
 # discord_bot.py
-from datetime import datetime
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 import asyncio
-from mcrcon import MCRcon
 
 # Import database functions
-from database import get_value, set_value, get_applications, save_applications, \
-                     get_application_from_queue, initial_setup, DB_FILE
+from database import set_value, get_applications, save_application, remove_application, \
+                     lease_application, ack_application, release_application, dead_letter_application, \
+                     get_dead_letter_applications, requeue_dead_letter_applications, initial_setup, \
+                     get_links, get_link, set_link, remove_link, find_links_by_name, remove_links_by_name, \
+                     relink, update, maintain_database
+from config import config
+from name_index import name_index
+from name_tracker import sync_link_identities
+import mojang
+import notify
+import rcon
 
 # --- Bot Setup ---
 intents = discord.Intents.default()
@@ -16,23 +23,22 @@ intents.members = True # Crucial for guild.get_member()
 bot = commands.Bot(command_prefix="!", intents=intents)
 
 # --- RCON Helper ---
-def execute_rcon_command(command):
-    rcon_host = get_value("rcon_host")
-    rcon_port = get_value("rcon_port")
-    rcon_password = get_value("rcon_password")
-    
-    if not all([rcon_host, rcon_port, rcon_password]):
-        return {"status": "error", "message": "RCON settings not fully configured."}
-        
+async def execute_rcon_command(command, timeout=rcon.COMMAND_TIMEOUT):
+    """Run a console command over the pooled RCON connections (see rcon.py)."""
+    return await rcon.execute(command, timeout)
+
+# --- Minecraft UUIDs ---
+async def resolve_minecraft_uuid(name):
+    """
+    Account UUID for a username, or None when Mojang doesn't know the name or
+    can't be reached; name_tracker fills in missing UUIDs later.
+    """
     try:
-        with MCRcon(rcon_host, rcon_password, port=int(rcon_port)) as mcr:
-            resp = mcr.command(command)
-            return {"status": "success", "message": resp}
-    except ConnectionRefusedError:
-        return {"status": "error", "message": "RCON connection refused. Is the server running and RCON enabled?"}
+        profile = await asyncio.to_thread(mojang.lookup_uuid, name)
     except Exception as e:
-        print(f"RCON Error: {e}")
-        return {"status": "error", "message": str(e)}
+        print(f"Could not resolve UUID for {name}: {e}")
+        return None
+    return profile["uuid"] if profile else None
 
 # --- Application View (for handling Accept/Deny buttons) ---
 class ApplicationView(discord.ui.View):
@@ -43,6 +49,7 @@ class ApplicationView(discord.ui.View):
 
     async def handle_application_action(self, interaction: discord.Interaction, status: str, color: discord.Color):
         await interaction.response.defer() # Acknowledge interaction
+        settings = config.current()
 
         player_name = self.application_data.get('in_game_name', 'N/A')
         discord_user_id = self.application_data.get('code') # This is the Discord User ID
@@ -89,7 +96,7 @@ class ApplicationView(discord.ui.View):
             await interaction.followup.send(embed=response_embed, ephemeral=True)
 
 
-        guild_id = get_value("guild")
+        guild_id = settings.guild
         if not guild_id:
             await interaction.followup.send("Error: Guild ID not configured.", ephemeral=True)
             return
@@ -110,16 +117,14 @@ class ApplicationView(discord.ui.View):
         # RCON Whitelisting and Role Assignment
         if status == "Accepted":
             if player_name != 'N/A':
-                whitelist_cmd_template = get_value("whitelist")
+                whitelist_cmd_template = settings.whitelist
                 rcon_command = f"{whitelist_cmd_template} {player_name}"
-                rcon_result = execute_rcon_command(rcon_command)
+                rcon_result = await execute_rcon_command(rcon_command)
 
                 if rcon_result["status"] == "success":
                     await interaction.followup.send(f"Successfully whitelisted {player_name} via RCON. {rcon_result['message']}", ephemeral=True)
                     # Add to links
-                    links = get_value("links") or {}
-                    links[str(discord_user_id)] = player_name
-                    set_value("links", links)
+                    set_link(discord_user_id, player_name, await resolve_minecraft_uuid(player_name))
                 else:
                     await interaction.followup.send(f"Warning: Failed to whitelist {player_name} via RCON: {rcon_result['message']}", ephemeral=True)
             
@@ -132,7 +137,7 @@ class ApplicationView(discord.ui.View):
                     print(f"Could not change nickname for {member}. Lacking permissions.")
                 except Exception as e:
                     print(f"Error changing nickname: {e}")
-                role_id = get_value("role")
+                role_id = settings.role
                 print(role_id)
                 if role_id:
                     role = guild.get_role(int(role_id))
@@ -166,8 +171,8 @@ class ApplicationView(discord.ui.View):
                         print(f"Found about me field: {key} = {about_me}")
                 
                 # Get the chat channel and intro channel IDs
-                chat_channel_id = get_value("chat_channel_id") or 1371760029161754675
-                intro_channel_id = get_value("intro_channel_id") or 1371760029161754675
+                chat_channel_id = settings.chat_channel_id or 1371760029161754675
+                intro_channel_id = settings.intro_channel_id or 1371760029161754675
                 
                 # Compare as string, handling various forms of "true"
                 if public_profile and str(public_profile).lower() in ['true', 'yes', '1', 'on'] and about_me:
@@ -242,10 +247,7 @@ class ApplicationView(discord.ui.View):
                     await interaction.followup.send(f"Note: Could not DM user {member.display_name} (they may have DMs disabled).", ephemeral=True)
 
         # Clean up application from active list
-        applications = get_applications()
-        if self.message_id in applications:
-            del applications[self.message_id]
-            save_applications(applications)
+        if remove_application(self.message_id):
             print(f"Removed application {self.message_id} after processing.")
         else:
             print(f"Warning: Tried to remove already processed or non-existent application {self.message_id}")
@@ -258,80 +260,143 @@ class ApplicationView(discord.ui.View):
     async def deny_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self.handle_application_action(interaction, "Denied", discord.Color.red())
 
-# --- Task to process applications from the shelve queue ---
-@tasks.loop(seconds=10) # Check for new applications every 10 seconds
+# --- Task to process applications from the queue ---
+# The webapp wakes us through notify.py as soon as it queues an application.
+# The loop below is only a slow fallback (missed datagrams, redelivered leases).
+queue_drain_lock = asyncio.Lock()
+notify_transport = None
+
+@tasks.loop(minutes=5)
 async def process_new_applications_task():
     await bot.wait_until_ready() # Ensure bot is logged in and cache is ready
-    
-    app_data = get_application_from_queue() # Fetches one at a time
-    if app_data:
-        print(f"Processing new application from queue: {app_data}")
-        discord_user_id = app_data.get('code')
-        in_game_name = app_data.get('in_game_name', 'N/A')
-
-        if not discord_user_id:
-            print("Error: Application data missing Discord User ID ('code'). Skipping.")
-            return
+    await drain_application_queue()
+
+async def drain_application_queue():
+    # Drain everything that is waiting instead of one application per tick
+    async with queue_drain_lock:
+        while True:
+            leased = lease_application()
+            if not leased:
+                return
+            item_id, app_data = leased
+            await post_application(item_id, app_data)
+
+def on_application_notification(message):
+    bot.loop.create_task(drain_application_queue())
+
+async def post_application(item_id, app_data):
+    """Post one leased application to the staff channel and ack it once it is stored."""
+    print(f"Processing new application from queue: {app_data}")
+    discord_user_id = app_data.get('code')
+    in_game_name = app_data.get('in_game_name', 'N/A')
+
+    if not discord_user_id:
+        print("Error: Application data missing Discord User ID ('code').")
+        dead_letter_application(item_id, "Missing Discord User ID ('code')")
+        return
 
-        guild_id = get_value("guild")
-        channel_id = get_value("channel")
+    settings = config.current()
+    guild_id = settings.guild
+    channel_id = settings.channel
 
-        if not guild_id or not channel_id:
-            print("Error: Guild or Channel ID not set. Cannot post application.")
-            # Optionally, re-queue the item or log to a dead-letter queue
-            # For now, we'll just drop it to prevent loop if config is missing
-            return
-            
-        guild = bot.get_guild(int(guild_id))
-        if not guild:
-            print(f"Error: Bot cannot find configured guild (ID: {guild_id}).")
-            return
+    if not guild_id or not channel_id:
+        print("Error: Guild or Channel ID not set. Cannot post application.")
+        # Keep it for /requeue_applications once the config is fixed
+        dead_letter_application(item_id, "Guild or Channel ID not set")
+        return
         
-        channel = guild.get_channel(int(channel_id)) # Or bot.get_channel()
-        if not channel:
-            print(f"Error: Bot cannot find configured channel (ID: {channel_id}).")
-            return
+    guild = bot.get_guild(int(guild_id))
+    if not guild:
+        print(f"Error: Bot cannot find configured guild (ID: {guild_id}).")
+        release_application(item_id, delay=60) # Retried until QUEUE_MAX_ATTEMPTS, then dead-lettered
+        return
+    
+    channel = guild.get_channel(int(channel_id)) # Or bot.get_channel()
+    if not channel:
+        print(f"Error: Bot cannot find configured channel (ID: {channel_id}).")
+        release_application(item_id, delay=60)
+        return
 
-        member = guild.get_member(int(discord_user_id))
-        if member:
-            try:
-                confirmation_embed = discord.Embed(
-                    title="Application Submitted",
-                    description="Your whitelist application has been successfully submitted and is awaiting review by staff.",
-                    color=discord.Color.orange()
-                )
-                await member.send(embed=confirmation_embed)
-            except discord.Forbidden:
-                print(f"Could not DM user {discord_user_id} with submission confirmation.")
-        else:
-            print(f"Could not find member with ID {discord_user_id} to send submission confirmation DM.")
+    member = guild.get_member(int(discord_user_id))
 
-        # Create embed for staff channel
-        staff_embed = discord.Embed(title="New Whitelist Application", color=discord.Color.blue())
-        staff_embed.add_field(name="Minecraft IGN", value=in_game_name, inline=False)
-        staff_embed.add_field(name="Discord User", value=member.mention if member else f"ID: {discord_user_id}", inline=False)
-        
-        # Add other form data to the embed
-        for key, value in app_data.items():
-            if key not in ['code', 'in_game_name']: # Already handled or internal
-                staff_embed.add_field(name=key.replace('_', ' ').title(), value=value, inline=False)
+    # Create embed for staff channel
+    staff_embed = discord.Embed(title="New Whitelist Application", color=discord.Color.blue())
+    staff_embed.add_field(name="Minecraft IGN", value=in_game_name, inline=False)
+    staff_embed.add_field(name="Discord User", value=member.mention if member else f"ID: {discord_user_id}", inline=False)
+    
+    # Add other form data to the embed
+    for key, value in app_data.items():
+        if key not in ['code', 'in_game_name']: # Already handled or internal
+            staff_embed.add_field(name=key.replace('_', ' ').title(), value=value, inline=False)
+    
+    try:
+        application_message = await channel.send(embed=staff_embed)
+        # Store application with message ID for the view
+        save_application(application_message.id, app_data)
+        ack_application(item_id)
         
-        try:
-            application_message = await channel.send(embed=staff_embed)
-            # Store application with message ID for the view
-            applications = get_applications()
-            applications[str(application_message.id)] = app_data
-            save_applications(applications)
-            
-            # Add view to the message
-            view = ApplicationView(app_data, application_message.id)
-            await application_message.edit(view=view)
-            print(f"Posted application for {in_game_name} to staff channel. Message ID: {application_message.id}")
+        # Add view to the message
+        view = ApplicationView(app_data, application_message.id)
+        await application_message.edit(view=view)
+        print(f"Posted application for {in_game_name} to staff channel. Message ID: {application_message.id}")
 
+    except discord.Forbidden:
+        print(f"Error: Bot lacks permission to send messages in channel {channel_id}.")
+        return # Not acked: redelivered after the visibility timeout
+    except Exception as e:
+        print(f"An error occurred while sending application to staff channel: {e}")
+        return
+
+    if member:
+        try:
+            confirmation_embed = discord.Embed(
+                title="Application Submitted",
+                description="Your whitelist application has been successfully submitted and is awaiting review by staff.",
+                color=discord.Color.orange()
+            )
+            await member.send(embed=confirmation_embed)
         except discord.Forbidden:
-            print(f"Error: Bot lacks permission to send messages in channel {channel_id}.")
-        except Exception as e:
-            print(f"An error occurred while sending application to staff channel: {e}")
+            print(f"Could not DM user {discord_user_id} with submission confirmation.")
+    else:
+        print(f"Could not find member with ID {discord_user_id} to send submission confirmation DM.")
+
+
+# --- Daily snapshot + compaction of the database ---
+@tasks.loop(hours=24)
+async def database_maintenance_task():
+    try:
+        # Runs in a worker thread so a long VACUUM doesn't stall the gateway
+        await asyncio.to_thread(maintain_database)
+    except Exception as e:
+        print(f"Database maintenance failed: {e}")
+
+@database_maintenance_task.before_loop
+async def before_database_maintenance():
+    await bot.wait_until_ready()
+    await asyncio.sleep(3600) # Don't compact right after every restart
+
+# --- Minecraft name tracking: follow account renames by UUID ---
+@tasks.loop(minutes=10)
+async def name_tracking_task():
+    try:
+        report = await asyncio.to_thread(sync_link_identities)
+        if report["resolved"] or report["renamed"]:
+            print(f"Name tracking: checked {report['checked']}, resolved {report['resolved']}, renamed {report['renamed']}")
+    except Exception as e:
+        print(f"Name tracking failed: {e}")
+
+@name_tracking_task.before_loop
+async def before_name_tracking():
+    await bot.wait_until_ready()
+
+def format_bytes(size):
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
 
 
 # --- Helper for checking managed roles ---
@@ -358,7 +423,7 @@ def has_managed_role():
         if not interaction.guild: return False # Should have guild context
 
         user_roles_ids = [role.id for role in interaction.user.roles]
-        managed_roles_ids = get_value("managed_roles")
+        managed_roles_ids = config.current().managed_roles
         if not managed_roles_ids: # If no roles are set, deny access for safety
             await interaction.response.send_message("No management roles configured. Access denied.", ephemeral=True)
             return False
@@ -373,6 +438,23 @@ def has_managed_role():
         return can_use
     return app_commands.check(predicate)
 
+NOTES_PAGE_SIZE = 10
+
+# --- Autocomplete for Minecraft username parameters ---
+async def minecraft_name_autocomplete(interaction: discord.Interaction, current: str):
+    return [app_commands.Choice(name=name, value=name) for name in name_index.complete(current)]
+
+async def minecraft_name_list_autocomplete(interaction: discord.Interaction, current: str):
+    # Complete the last name of a comma-separated list, keeping the earlier ones
+    head, _, last = current.rpartition(",")
+    head = f"{head.strip()}, " if head.strip() else ""
+    choices = []
+    for name in name_index.complete(last.strip()):
+        value = head + name
+        if len(value) <= 100: # Discord's limit for choice values
+            choices.append(app_commands.Choice(name=value, value=value))
+    return choices
+
 # --- Slash Commands ---
 @bot.event
 async def on_ready():
@@ -381,8 +463,9 @@ async def on_ready():
     # Load persistent views
     # This ensures buttons on old messages still work after bot restarts.
     applications = get_applications()
-    guild_id = get_value("guild") # Get guild_id once
-    channel_id = get_value("channel") # Get channel_id once
+    settings = config.current()
+    guild_id = settings.guild
+    channel_id = settings.channel
 
     if guild_id and channel_id:
         guild = bot.get_guild(int(guild_id))
@@ -413,11 +496,8 @@ async def on_ready():
                     except Exception as e:
                         print(f"Error re-adding view to message {msg_id_str}: {e}")
                 
-                if apps_to_remove:
-                    current_apps = get_applications()
-                    for m_id in apps_to_remove:
-                        current_apps.pop(m_id, None)
-                    save_applications(current_apps)
+                for m_id in apps_to_remove:
+                    remove_application(m_id)
                 print(f"Re-added views to {active_app_count} active application messages.")
             else:
                 print("Configured application channel not found on ready.")
@@ -432,9 +512,22 @@ async def on_ready():
     except Exception as e:
         print(f"Failed to sync slash commands: {e}")
 
+    global notify_transport
+    if notify_transport is None:
+        try:
+            notify_transport = await notify.listen(on_application_notification)
+        except OSError as e:
+            print(f"Could not listen for application notifications, falling back to polling: {e}")
+
     if not process_new_applications_task.is_running():
         process_new_applications_task.start()
 
+    if not database_maintenance_task.is_running():
+        database_maintenance_task.start()
+
+    if not name_tracking_task.is_running():
+        name_tracking_task.start()
+
 @bot.tree.command(name="relink", description="Relink a Discord user to a different Minecraft username or fix incorrect links.")
 @has_managed_role()
 @app_commands.describe(
@@ -442,27 +535,18 @@ async def on_ready():
     new_minecraft_username="New Minecraft username to link to this Discord user",
     old_minecraft_username="Old/current Minecraft username (optional - helps find existing link)"
 )
+@app_commands.autocomplete(old_minecraft_username=minecraft_name_autocomplete)
 async def relink_command(interaction: discord.Interaction, discord_user: discord.Member, new_minecraft_username: str, old_minecraft_username: str = None):
     await interaction.response.defer(ephemeral=True)
     
-    links = get_value("links") or {}
     discord_id = str(discord_user.id)
     
-    # Check if the new username is already linked to someone else
-    existing_discord_id = None
-    for existing_id, minecraft_name in links.items():
-        if minecraft_name.lower() == new_minecraft_username.lower():
-            existing_discord_id = existing_id
-            break
-    
-    # Remove old link for this Discord user
-    old_username = None
-    if discord_id in links:
-        old_username = links[discord_id]
-        del links[discord_id]
+    # Atomically replace this user's link and drop any other link to the new username
+    old_username, existing_discord_id = relink(
+        discord_id, new_minecraft_username, await resolve_minecraft_uuid(new_minecraft_username)
+    )
     
-    # If new username was linked to someone else, remove that link too
-    if existing_discord_id and existing_discord_id != discord_id:
+    if existing_discord_id:
         old_owner = None
         if existing_discord_id.startswith("manual_"):
             old_owner = "Manual entry"
@@ -472,12 +556,6 @@ async def relink_command(interaction: discord.Interaction, discord_user: discord
                 old_owner = old_member.display_name if old_member else f"Discord ID: {existing_discord_id}"
             except ValueError:
                 old_owner = f"Invalid Discord ID: {existing_discord_id}"
-        
-        del links[existing_discord_id]
-    
-    # Create the new link
-    links[discord_id] = new_minecraft_username
-    set_value("links", links)
     
     # Update the user's nickname to match their new Minecraft username
     try:
@@ -494,7 +572,7 @@ async def relink_command(interaction: discord.Interaction, discord_user: discord
     if old_username:
         response_parts.append(f"Previous link: **{old_username}** → {discord_user.display_name}")
     
-    if existing_discord_id and existing_discord_id != discord_id:
+    if existing_discord_id:
         response_parts.append(f"Removed conflicting link: **{new_minecraft_username}** → {old_owner}")
     
     if nickname_updated:
@@ -503,16 +581,16 @@ async def relink_command(interaction: discord.Interaction, discord_user: discord
         response_parts.append("⚠️ Could not update Discord nickname (insufficient permissions)")
     
     # Optional: Update whitelist on Minecraft server
-    whitelist_cmd_template = get_value("whitelist")
+    whitelist_cmd_template = config.current().whitelist
     if whitelist_cmd_template:
         # Remove old username from whitelist if it exists
         if old_username and old_username.lower() != new_minecraft_username.lower():
-            remove_result = execute_rcon_command(f"whitelist remove {old_username}")
+            remove_result = await execute_rcon_command(f"whitelist remove {old_username}")
             if remove_result["status"] == "success":
                 response_parts.append(f"Removed **{old_username}** from server whitelist")
         
         # Add new username to whitelist
-        add_result = execute_rcon_command(f"{whitelist_cmd_template} {new_minecraft_username}")
+        add_result = await execute_rcon_command(f"{whitelist_cmd_template} {new_minecraft_username}")
         if add_result["status"] == "success":
             response_parts.append(f"Added **{new_minecraft_username}** to server whitelist")
         else:
@@ -531,9 +609,11 @@ async def relink_command(interaction: discord.Interaction, discord_user: discord
 @app_commands.describe(
     discord_user="Discord user to add note for",
     minecraft_username="Minecraft username to add note for", 
-    note="Note to add (leave empty to view existing notes)"
+    note="Note to add (leave empty to view existing notes)",
+    page="Page of notes to show (10 per page)"
 )
-async def notes_command(interaction: discord.Interaction, discord_user: discord.Member = None, minecraft_username: str = None, note: str = None):
+@app_commands.autocomplete(minecraft_username=minecraft_name_autocomplete)
+async def notes_command(interaction: discord.Interaction, discord_user: discord.Member = None, minecraft_username: str = None, note: str = None, page: int = 1):
     await interaction.response.defer(ephemeral=True)
     
     if not discord_user and not minecraft_username:
@@ -549,12 +629,10 @@ async def notes_command(interaction: discord.Interaction, discord_user: discord.
         display_name = discord_user.display_name
     elif minecraft_username:
         # Check if user exists in links
-        links = get_value("links") or {}
-        for discord_id, minecraft_name in links.items():
-            if minecraft_name.lower() == minecraft_username.lower():
-                user_identifier = discord_id
-                display_name = minecraft_username
-                break
+        for discord_id, minecraft_name in find_links_by_name(minecraft_username):
+            user_identifier = discord_id
+            display_name = minecraft_username
+            break
         if not user_identifier:
             user_identifier = minecraft_username
             display_name = minecraft_username
@@ -565,27 +643,65 @@ async def notes_command(interaction: discord.Interaction, discord_user: discord.
         add_user_note(user_identifier, note, interaction.user.display_name)
         await interaction.followup.send(f"Added note for {display_name}.")
     else:
-        # View notes
-        from database import get_user_notes
-        notes = get_user_notes(user_identifier)
+        # View notes, one page at a time (embeds hold at most 25 fields)
+        from database import get_user_notes, count_user_notes
+        total = count_user_notes(user_identifier)
         
-        if not notes:
+        if not total:
             await interaction.followup.send(f"No notes found for {display_name}.")
             return
         
+        pages = (total + NOTES_PAGE_SIZE - 1) // NOTES_PAGE_SIZE
+        page = min(max(page, 1), pages)
+        offset = (page - 1) * NOTES_PAGE_SIZE
+        notes = get_user_notes(user_identifier, offset=offset, limit=NOTES_PAGE_SIZE)
+        
         embed = discord.Embed(title=f"Notes for {display_name}", color=discord.Color.blue())
-        for i, note_entry in enumerate(notes):
+        for i, note_entry in enumerate(notes, start=offset):
             timestamp = note_entry.get("timestamp", "Unknown time")
             author = note_entry.get("author", "Unknown")
             note_text = note_entry.get("note", "")
             embed.add_field(
                 name=f"Note {i+1} - {author}",
-                value=f"{note_text}\n*{timestamp}*",
+                value=f"{note_text[:950]}\n*{timestamp}*",
                 inline=False
             )
+        embed.set_footer(text=f"Page {page}/{pages} • {total} note(s)")
         
         await interaction.followup.send(embed=embed)
 
+@bot.tree.command(name="search_notes", description="Search the text of all player notes.")
+@has_managed_role()
+@app_commands.describe(query="Whole words to search for; end a word with * to match its start (e.g. grief*)", page="Page of results to show (10 per page)")
+async def search_notes_command(interaction: discord.Interaction, query: str, page: int = 1):
+    await interaction.response.defer(ephemeral=True)
+    
+    from database import search_notes
+    page = max(page, 1)
+    results, total = search_notes(query, offset=(page - 1) * NOTES_PAGE_SIZE, limit=NOTES_PAGE_SIZE)
+    
+    if not total:
+        await interaction.followup.send(f"No notes matching **{query}**.")
+        return
+    
+    pages = (total + NOTES_PAGE_SIZE - 1) // NOTES_PAGE_SIZE
+    if not results:
+        await interaction.followup.send(f"Only {pages} page(s) of results for **{query}**.")
+        return
+    
+    embed = discord.Embed(title=f"Notes matching \"{query}\"", color=discord.Color.blue())
+    for note_entry in results:
+        user_key = note_entry["user_key"]
+        # Notes are stored against a Discord ID when the player is linked
+        who = get_link(user_key) or user_key
+        embed.add_field(
+            name=f"{who} - {note_entry.get('author', 'Unknown')}",
+            value=f"{note_entry['note'][:950]}\n*{note_entry.get('timestamp', 'Unknown time')}*",
+            inline=False
+        )
+    embed.set_footer(text=f"Page {page}/{pages} • {total} match(es)")
+    await interaction.followup.send(embed=embed)
+
 @bot.tree.command(name="flag", description="Flag a user positively or negatively.")
 @has_managed_role()
 @app_commands.describe(
@@ -593,6 +709,7 @@ async def notes_command(interaction: discord.Interaction, discord_user: discord.
     minecraft_username="Minecraft username to flag",
     flag_type="Type of flag (positive/amber/negative/remove)"
 )
+@app_commands.autocomplete(minecraft_username=minecraft_name_autocomplete)
 @app_commands.choices(flag_type=[
     app_commands.Choice(name="Positive", value="positive"),
     app_commands.Choice(name="Amber Warning", value="amber"),
@@ -614,12 +731,10 @@ async def flag_command(interaction: discord.Interaction, flag_type: str, discord
         user_identifier = str(discord_user.id)
         display_name = discord_user.display_name
     elif minecraft_username:
-        links = get_value("links") or {}
-        for discord_id, minecraft_name in links.items():
-            if minecraft_name.lower() == minecraft_username.lower():
-                user_identifier = discord_id
-                display_name = minecraft_username
-                break
+        for discord_id, minecraft_name in find_links_by_name(minecraft_username):
+            user_identifier = discord_id
+            display_name = minecraft_username
+            break
         if not user_identifier:
             user_identifier = minecraft_username
             display_name = minecraft_username
@@ -685,7 +800,7 @@ async def list_flags_command(interaction: discord.Interaction, flag_filter: str
     
     # Get guild for member lookup
     guild = interaction.guild
-    links = get_value("links") or {}
+    links = get_links()
     
     # Build the list
     flag_list = []
@@ -741,6 +856,7 @@ async def list_flags_command(interaction: discord.Interaction, flag_filter: str
     discord_user="Discord user to search for",
     minecraft_username="Minecraft username to search for"
 )
+@app_commands.autocomplete(minecraft_username=minecraft_name_autocomplete)
 async def find_player(interaction: discord.Interaction, discord_user: discord.Member = None, minecraft_username: str = None):
     await interaction.response.defer(ephemeral=True)
 
@@ -748,18 +864,17 @@ async def find_player(interaction: discord.Interaction, discord_user: discord.Me
         await interaction.followup.send("You must provide either a Discord user or Minecraft username to search for.", ephemeral=True)
         return
 
-    links = get_value("links") or {}
     found_matches = []
 
     # Search by Discord user
     if discord_user:
         discord_id = str(discord_user.id)
-        if discord_id in links:
-            minecraft_name = links[discord_id]
+        minecraft_name = get_link(discord_id)
+        if minecraft_name:
             
             # Get notes and flag
-            from database import get_user_notes, get_user_flag
-            notes = get_user_notes(discord_id)
+            from database import count_user_notes, get_user_flag
+            notes = count_user_notes(discord_id)
             flag = get_user_flag(discord_id)
             
             match_info = f"Discord: {discord_user.display_name} ({discord_user.mention})\nMinecraft: {minecraft_name}"
@@ -772,44 +887,52 @@ async def find_player(interaction: discord.Interaction, discord_user: discord.Me
             
             # Add notes count
             if notes:
-                match_info += f"\nNotes: {len(notes)} note(s)"
+                match_info += f"\nNotes: {notes} note(s)"
             
             found_matches.append(match_info)
 
     # Search by Minecraft username
     if minecraft_username:
-        for discord_id, minecraft_name in links.items():
-            if minecraft_name.lower() == minecraft_username.lower():
-                from database import get_user_notes, get_user_flag
-                notes = get_user_notes(discord_id)
-                flag = get_user_flag(discord_id)
-                
-                if discord_id.startswith("manual"):
-                    match_info = f"Minecraft: {minecraft_name}\nType: Manual whitelist"
+        for discord_id, minecraft_name in find_links_by_name(minecraft_username):
+            from database import count_user_notes, get_user_flag
+            notes = count_user_notes(discord_id)
+            flag = get_user_flag(discord_id)
+            
+            if discord_id.startswith("manual"):
+                match_info = f"Minecraft: {minecraft_name}\nType: Manual whitelist"
+            else:
+                member = interaction.guild.get_member(int(discord_id)) if interaction.guild else None
+                if member:
+                    match_info = f"Minecraft: {minecraft_name}\nDiscord: {member.display_name} ({member.mention})"
                 else:
-                    member = interaction.guild.get_member(int(discord_id)) if interaction.guild else None
-                    if member:
-                        match_info = f"Minecraft: {minecraft_name}\nDiscord: {member.display_name} ({member.mention})"
-                    else:
-                        match_info = f"Minecraft: {minecraft_name}\nDiscord ID: {discord_id} (User not found)"
-                
-                # Add flag info with proper emoji
-                if flag:
-                    flag_emojis = {"positive": "🟢", "amber": "🟡", "negative": "🔴"}
-                    flag_emoji = flag_emojis.get(flag, "❓")
-                    match_info += f"\nFlag: {flag.title()} {flag_emoji}"
-                
-                # Add notes count
-                if notes:
-                    match_info += f"\nNotes: {len(notes)} note(s)"
-                
-                found_matches.append(match_info)
+                    match_info = f"Minecraft: {minecraft_name}\nDiscord ID: {discord_id} (User not found)"
+            
+            # Add flag info with proper emoji
+            if flag:
+                flag_emojis = {"positive": "🟢", "amber": "🟡", "negative": "🔴"}
+                flag_emoji = flag_emojis.get(flag, "❓")
+                match_info += f"\nFlag: {flag.title()} {flag_emoji}"
+            
+            # Add notes count
+            if notes:
+                match_info += f"\nNotes: {notes} note(s)"
+            
+            found_matches.append(match_info)
+
+    # Typo-tolerant fallback when the exact name isn't linked
+    suggestions = []
+    if minecraft_username and not find_links_by_name(minecraft_username):
+        suggestions = name_index.fuzzy(minecraft_username, limit=5)
 
     if found_matches:
         embed = discord.Embed(title="Player Search Results", color=discord.Color.green())
         for i, match in enumerate(found_matches):
             embed.add_field(name=f"Match {i+1}", value=match, inline=False)
+        if suggestions:
+            embed.add_field(name="Did you mean", value=", ".join(suggestions), inline=False)
         await interaction.followup.send(embed=embed)
+    elif suggestions:
+        await interaction.followup.send(f"No exact match for **{minecraft_username}**. Did you mean: {', '.join(f'**{name}**' for name in suggestions)}?")
     else:
         await interaction.followup.send("No matching players found in the database.")
 
@@ -849,10 +972,15 @@ async def set_member_role(interaction: discord.Interaction, role: discord.Role):
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(role="The role to add.")
 async def add_management_role(interaction: discord.Interaction, role: discord.Role):
-    managed_roles = get_value("managed_roles") or []
-    if role.id not in managed_roles:
-        managed_roles.append(role.id)
-        set_value("managed_roles", managed_roles)
+    added = []
+    def add_role(managed_roles):
+        managed_roles = managed_roles or []
+        if role.id in managed_roles:
+            return managed_roles
+        added.append(role.id)
+        return managed_roles + [role.id]
+    update("managed_roles", add_role)
+    if added:
         await interaction.response.send_message(f"Role '{role.name}' can now use management commands.", ephemeral=True)
     else:
         await interaction.response.send_message(f"Role '{role.name}' is already in the management list.", ephemeral=True)
@@ -861,10 +989,14 @@ async def add_management_role(interaction: discord.Interaction, role: discord.Ro
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(role="The role to remove.")
 async def remove_management_role(interaction: discord.Interaction, role: discord.Role):
-    managed_roles = get_value("managed_roles") or []
-    if role.id in managed_roles:
-        managed_roles.remove(role.id)
-        set_value("managed_roles", managed_roles)
+    removed = []
+    def remove_role(managed_roles):
+        managed_roles = managed_roles or []
+        if role.id in managed_roles:
+            removed.append(role.id)
+        return [r for r in managed_roles if r != role.id]
+    update("managed_roles", remove_role)
+    if removed:
         await interaction.response.send_message(f"Role '{role.name}' can no longer use management commands.", ephemeral=True)
     else:
         await interaction.response.send_message(f"Role '{role.name}' is not in the management list.", ephemeral=True)
@@ -892,7 +1024,7 @@ async def set_whitelist_rcon_command(interaction: discord.Interaction, command:
 @app_commands.describe(command="The command to execute (without '/')")
 async def rcon_command(interaction: discord.Interaction, command: str):
     await interaction.response.defer(ephemeral=True)
-    result = execute_rcon_command(command)
+    result = await execute_rcon_command(command)
     if result["status"] == "success":
         await interaction.followup.send(f"RCON Success: ```{result['message']}```")
     else:
@@ -903,20 +1035,18 @@ async def rcon_command(interaction: discord.Interaction, command: str):
 @app_commands.describe(username="Minecraft username")
 async def manual_whitelist(interaction: discord.Interaction, username: str):
     await interaction.response.defer(ephemeral=True)
-    whitelist_cmd_template = get_value("whitelist")
+    whitelist_cmd_template = config.current().whitelist
     if not whitelist_cmd_template:
         await interaction.followup.send("Whitelist command not configured. Use `/set_whitelist_rcon_command`.",ephemeral=True)
         return
         
     rcon_command_to_run = f"{whitelist_cmd_template} {username}"
-    result =  execute_rcon_command(rcon_command_to_run)
+    result = await execute_rcon_command(rcon_command_to_run)
     
     if result["status"] == "success":
         # Add to links so player appears on the website (if desired)
-        links = get_value("links") or {}
         # Use a placeholder for Discord ID for manually added players or decide on a convention
-        links[f"manual_{username}"] = username
-        set_value("links", links)
+        set_link(f"manual_{username}", username, await resolve_minecraft_uuid(username))
         await interaction.followup.send(f"Successfully whitelisted {username}: {result['message']}")
     else:
         await interaction.followup.send(f"Failed to whitelist {username}: {result['message']}")
@@ -924,25 +1054,17 @@ async def manual_whitelist(interaction: discord.Interaction, username: str):
 @bot.tree.command(name="remove_whitelist", description="Remove a player from the whitelist via RCON.")
 @has_managed_role()
 @app_commands.describe(username="Minecraft username to remove")
+@app_commands.autocomplete(username=minecraft_name_autocomplete)
 async def remove_whitelist(interaction: discord.Interaction, username: str):
     await interaction.response.defer(ephemeral=True)
     
     # Execute whitelist remove command
     rcon_command = f"whitelist remove {username}"
-    result = execute_rcon_command(rcon_command)
+    result = await execute_rcon_command(rcon_command)
     
     if result["status"] == "success":
         # Remove from links database
-        links = get_value("links") or {}
-        removed_entries = []
-        
-        # Find and remove entries with this username
-        for discord_id, minecraft_name in list(links.items()):
-            if minecraft_name.lower() == username.lower():
-                del links[discord_id]
-                removed_entries.append(discord_id)
-        
-        set_value("links", links)
+        removed_entries = remove_links_by_name(username)
         
         response_msg = f"Successfully removed {username} from whitelist: {result['message']}"
         if removed_entries:
@@ -958,6 +1080,7 @@ async def remove_whitelist(interaction: discord.Interaction, username: str):
     discord_user="Discord user to remove data for",
     minecraft_username="Minecraft username to remove (optional if discord_user provided)"
 )
+@app_commands.autocomplete(minecraft_username=minecraft_name_autocomplete)
 async def remove_player_data(interaction: discord.Interaction, discord_user: discord.Member = None, minecraft_username: str = None):
     await interaction.response.defer(ephemeral=True)
     
@@ -965,25 +1088,19 @@ async def remove_player_data(interaction: discord.Interaction, discord_user: dis
         await interaction.followup.send("You must provide either a Discord user or Minecraft username.", ephemeral=True)
         return
     
-    links = get_value("links") or {}
     removed_entries = []
     
     # Remove by Discord user
     if discord_user:
-        discord_id = str(discord_user.id)
-        if discord_id in links:
-            minecraft_name = links[discord_id]
-            del links[discord_id]
+        minecraft_name = remove_link(discord_user.id)
+        if minecraft_name:
             removed_entries.append(f"Discord: {discord_user.display_name} -> Minecraft: {minecraft_name}")
     
     # Remove by Minecraft username
     if minecraft_username:
-        for discord_id, minecraft_name in list(links.items()):
-            if minecraft_name.lower() == minecraft_username.lower():
-                del links[discord_id]
-                removed_entries.append(f"Discord ID: {discord_id} -> Minecraft: {minecraft_name}")
-    
-    set_value("links", links)
+        for discord_id, minecraft_name in find_links_by_name(minecraft_username):
+            remove_link(discord_id)
+            removed_entries.append(f"Discord ID: {discord_id} -> Minecraft: {minecraft_name}")
     
     if removed_entries:
         response = f"Removed {len(removed_entries)} player link(s) from database:\n"
@@ -998,7 +1115,7 @@ async def remove_player_data(interaction: discord.Interaction, discord_user: dis
 async def list_whitelisted_players(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     
-    links = get_value("links") or {}
+    links = get_links()
     
     if not links:
         await interaction.followup.send("No whitelisted players found in the database.")
@@ -1038,6 +1155,7 @@ async def list_whitelisted_players(interaction: discord.Interaction):
 @bot.tree.command(name="bulk_remove_whitelist", description="Remove multiple players from whitelist (comma-separated usernames).")
 @has_required_role()
 @app_commands.describe(usernames="Comma-separated list of Minecraft usernames to remove")
+@app_commands.autocomplete(usernames=minecraft_name_list_autocomplete)
 async def bulk_remove_whitelist(interaction: discord.Interaction, usernames: str):
     await interaction.response.defer(ephemeral=True)
     
@@ -1053,27 +1171,20 @@ async def bulk_remove_whitelist(interaction: discord.Interaction, usernames: str
         return
     
     results = []
-    links = get_value("links") or {}
     
     for username in username_list:
         # Execute whitelist remove command
         rcon_command = f"whitelist remove {username}"
-        result = execute_rcon_command(rcon_command)
+        result = await execute_rcon_command(rcon_command)
         
         if result["status"] == "success":
             # Remove from links database
-            removed_count = 0
-            for discord_id, minecraft_name in list(links.items()):
-                if minecraft_name.lower() == username.lower():
-                    del links[discord_id]
-                    removed_count += 1
+            removed_count = len(remove_links_by_name(username))
             
             results.append(f"✅ **{username}**: Removed from whitelist (DB entries: {removed_count})")
         else:
             results.append(f"❌ **{username}**: {result['message']}")
     
-    set_value("links", links)
-    
     embed = discord.Embed(title="Bulk Whitelist Removal Results", color=discord.Color.orange())
     embed.description = "\n".join(results)
     await interaction.followup.send(embed=embed)
@@ -1083,7 +1194,7 @@ async def bulk_remove_whitelist(interaction: discord.Interaction, usernames: str
 async def cleanup_database(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     
-    links = get_value("links") or {}
+    links = get_links()
     guild = interaction.guild
     
     if not guild:
@@ -1091,7 +1202,7 @@ async def cleanup_database(interaction: discord.Interaction):
         return
     
     # Get the whitelist from the server via RCON
-    whitelist_result = execute_rcon_command("whitelist list")
+    whitelist_result = await execute_rcon_command("whitelist list")
     if whitelist_result["status"] != "success":
         await interaction.followup.send(f"Failed to get whitelist from server: {whitelist_result['message']}", ephemeral=True)
         return
@@ -1125,7 +1236,6 @@ async def cleanup_database(interaction: discord.Interaction):
     members_with_role = [member for member in guild.members if target_role in member.roles]
     
     cleaned_entries = []
-    valid_links = {}
     not_in_database = []
     removed_from_server = []
     not_whitelisted_members = []
@@ -1156,28 +1266,25 @@ async def cleanup_database(interaction: discord.Interaction):
     for discord_id, minecraft_name in links.items():
         # Skip manual entries
         if discord_id.startswith("manual_"):
-            valid_links[discord_id] = minecraft_name
             continue
         
         # Check if Discord user still exists in server
         try:
             member = guild.get_member(int(discord_id))
-            if member:
-                valid_links[discord_id] = minecraft_name
-            else:
+            if not member:
                 # User not in server - remove from whitelist and database
-                remove_result = execute_rcon_command(f"whitelist remove {minecraft_name}")
+                remove_result = await execute_rcon_command(f"whitelist remove {minecraft_name}")
                 if remove_result["status"] == "success":
                     removed_from_server.append(f"Removed {minecraft_name} from whitelist (user left server)")
                 else:
                     removed_from_server.append(f"Failed to remove {minecraft_name} from whitelist: {remove_result['message']}")
                 
+                remove_link(discord_id)
                 cleaned_entries.append(f"Removed: {minecraft_name} (Discord user not in server)")
         except ValueError:
+            remove_link(discord_id)
             cleaned_entries.append(f"Removed: {minecraft_name} (Invalid Discord ID: {discord_id})")
     
-    set_value("links", valid_links)
-    
     # Create comprehensive report
     embed = discord.Embed(title="Database Cleanup & Whitelist Check Results", color=discord.Color.yellow())
     
@@ -1220,22 +1327,58 @@ async def cleanup_database(interaction: discord.Interaction):
 async def test_rcon_connection(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     # A simple command like 'list' or 'version' is good for testing
-    result = execute_rcon_command("list")     
+    result = await execute_rcon_command("list")     
     if result["status"] == "success":
         await interaction.followup.send(f"RCON connection successful! Response: ```{result['message']}```")
     else:
         await interaction.followup.send(f"RCON connection failed: {result['message']}")
 
 
+@bot.tree.command(name="requeue_applications", description="Re-queue applications that could not be posted (Admin Only).")
+@app_commands.checks.has_permissions(administrator=True)
+async def requeue_applications(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    dead_letters = get_dead_letter_applications()
+    if not dead_letters:
+        await interaction.followup.send("No failed applications waiting.")
+        return
+    
+    summary = "\n".join(
+        f"• **{entry['data'].get('in_game_name', 'N/A')}**: {entry['reason']}" for entry in dead_letters[:20]
+    )
+    count = requeue_dead_letter_applications()
+    await interaction.followup.send(f"Re-queued {count} application(s):\n{summary}")
+
+@bot.tree.command(name="compact_database", description="Back up and compact the bot database while it stays online (Admin Only).")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(backup="Write a snapshot to the backups folder first (default: yes)")
+async def compact_database(interaction: discord.Interaction, backup: bool = True):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        report = await asyncio.to_thread(maintain_database, backup)
+    except Exception as e:
+        await interaction.followup.send(f"Database maintenance failed: {e}")
+        return
+    
+    lines = [
+        f"Size before: {format_bytes(report['size_before'])}",
+        f"Size after: {format_bytes(report['size_after'])}",
+        f"Took {report['seconds']}s",
+    ]
+    if report["snapshot"]:
+        lines.append(f"Snapshot: `{report['snapshot']}`")
+    embed = discord.Embed(title="Database Maintenance", description="\n".join(lines), color=discord.Color.green())
+    await interaction.followup.send(embed=embed)
+
 # --- Main Execution ---
 if __name__ == "__main__":
-    bot_token = get_value("token")
+    bot_token = config.current().token
     if not bot_token:
         print("Bot token not found in database. Running initial setup...")
         # Try to run initial setup if essential configs are missing
         # This helps on first run if DB is empty.
         initial_setup()
-        bot_token = get_value("token")
+        bot_token = config.current().token
         if not bot_token:
             print("CRITICAL: Bot token is still not set after setup attempt. Exiting.")
             exit() # Or raise an error
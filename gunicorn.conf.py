@@ -0,0 +1,53 @@
+# gunicorn.conf.py
+# Production settings for the web app:
+#
+#   gunicorn -c gunicorn.conf.py webapp:app
+#
+# DWP_WORKER_CLASS picks how a worker waits on Discord and Mojang:
+#   gthread (default)  a thread per in-flight request (DWP_THREADS per worker)
+#   gevent             cooperative workers: sockets are monkey-patched, so the
+#                      shared HTTP client and the background threads yield
+#                      while they wait. sqlite3 is C code and can't yield, so
+#                      storage.py runs database calls on gevent's threadpool
+#                      with a small pool of connections; a wait for the write
+#                      lock (DWP_DB_BUSY_TIMEOUT, 10 s by default) ties up one
+#                      OS thread, not the worker. One process holds
+#                      DWP_WORKER_CONNECTIONS requests, which suits bursts of
+#                      /callback, /whitelist and /submit. Needs `pip install gevent`.
+import os
+import multiprocessing
+
+bind = os.environ.get("DWP_BIND", "0.0.0.0:80")
+workers = int(os.environ.get("DWP_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = os.environ.get("DWP_WORKER_CLASS", "gthread")
+timeout = 30 # Discord/Mojang calls and database lock waits give up well before this
+graceful_timeout = 20
+keepalive = 5
+
+if worker_class == "gevent":
+    try:
+        import gevent # noqa: F401 (only checking it's installed)
+    except ImportError:
+        print("gevent is not installed; falling back to gthread workers")
+        worker_class = "gthread"
+
+if worker_class == "gevent":
+    worker_connections = int(os.environ.get("DWP_WORKER_CONNECTIONS", 1000))
+    # The app must be imported after each worker has monkey-patched the standard
+    # library, or its module-level locks, pools and sessions stay blocking
+    preload_app = False
+else:
+    threads = int(os.environ.get("DWP_THREADS", 16))
+
+
+def on_starting(server):
+    # Workers of a previous run left their metric snapshots behind; start counting afresh.
+    # Imported here so the master doesn't load app modules before gevent patches them.
+    import metrics
+    metrics.clear()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counts in the service totals (see metrics.py)
+    import metrics
+    metrics.archive_worker(worker.pid)
@@ -0,0 +1,208 @@
+# http_client.py
+# Shared outbound HTTP client for Mojang and Discord. One requests.Session keeps
+# a keep-alive connection pool per host, every call has connect/read timeouts,
+# idempotent calls are retried with jittered backoff, and a per-host circuit
+# breaker fails fast while an upstream keeps erroring so it can't pin workers.
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_SECONDS
+
+DEFAULT_TIMEOUT = (3.05, 10) # (connect, read) seconds
+DEFAULT_RETRIES = 2 # Extra attempts for idempotent requests
+RETRY_BACKOFF = 0.25 # Base delay in seconds, doubled per attempt, with full jitter
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRY_AFTER = 5 # Never sleep longer than this for a Retry-After header
+POOL_SIZE = int(os.environ.get("DWP_HTTP_POOL_SIZE", 20)) # Keep-alive connections per host; raise for gevent workers
+BREAKER_FAILURES = 5 # Consecutive failures that open a host's circuit
+BREAKER_RESET_SECONDS = 30 # How long an open circuit fails fast before a trial request
+# Errors worth another attempt; any other RequestException still counts as a failure
+RETRY_ERRORS = (
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError,
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """False to fail fast, else "closed" or "trial" (the one request probing a half-open host)."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True # Let exactly one request probe the host
+                return "trial"
+            return False
+
+    def end_trial(self):
+        """Free the trial slot if the probe ended without recording a result."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class HostStats:
+    """Counters for one host, updated under its breaker's lock (gthread workers share them)."""
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def observe(self, elapsed, error):
+        with self._lock:
+            self.requests += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            if error:
+                self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "short_circuited": self.short_circuited,
+                "avg_ms": round(self.total_seconds / self.requests * 1000, 1) if self.requests else 0,
+                "max_ms": round(self.max_seconds * 1000, 1),
+            }
+
+
+class HttpClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+                self._stats[host] = HostStats(self._breakers[host]._lock)
+            return self._breakers[host], self._stats[host]
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), MAX_RETRY_AFTER)
+        return random.uniform(0, RETRY_BACKOFF * (2 ** attempt))
+
+    def request(self, method, url, retries=None, **kwargs):
+        """
+        Like requests.request, with pooled connections, default timeouts and
+        circuit breaking. GET/HEAD are retried by default; pass retries= to
+        retry other methods (only when the call is safe to repeat).
+        """
+        host = urlparse(url).netloc
+        breaker, stats = self._host_state(host)
+        if retries is None:
+            retries = self.retries if method.upper() in ("GET", "HEAD") else 0
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(retries + 1):
+            permit = breaker.allow()
+            if not permit:
+                stats.count("short_circuited")
+                raise CircuitOpenError(f"Circuit open for {host}; not calling it for now")
+            started = time.monotonic()
+            try:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    self._record(host, stats, started, error=True)
+                    breaker.record_failure()
+                    if attempt < retries and isinstance(e, RETRY_ERRORS):
+                        stats.count("retries")
+                        time.sleep(self._backoff(attempt))
+                        continue
+                    raise
+                failed = response.status_code >= 500 or response.status_code == 429
+                self._record(host, stats, started, error=failed)
+                if failed:
+                    breaker.record_failure()
+                    if attempt < retries and response.status_code in RETRY_STATUSES:
+                        stats.count("retries")
+                        time.sleep(self._backoff(attempt, response))
+                        continue
+                else:
+                    breaker.record_success()
+                return response
+            finally:
+                if permit == "trial":
+                    breaker.end_trial() # Also after errors outside requests (bad URL, interrupted)
+
+    def _record(self, host, stats, started, error):
+        elapsed = time.monotonic() - started
+        UPSTREAM_SECONDS.observe(elapsed, host=host)
+        stats.observe(elapsed, error)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        """Per-host counters and breaker state, e.g. for logging or /metrics."""
+        with self._lock:
+            hosts = list(self._stats)
+        return {
+            host: {**self._stats[host].as_dict(), "circuit": self._breakers[host].state}
+            for host in hosts
+        }
+
+
+client = HttpClient()
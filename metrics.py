@@ -0,0 +1,272 @@
+# metrics.py
+# Prometheus-style metrics without extra dependencies. Counters and histograms
+# live in the process that records them; each gunicorn worker writes its values
+# to METRICS_DIR/<pid>-<start ms>.json every few seconds (the start time keeps a
+# recycled PID from overwriting an older worker's file), and a /metrics scrape
+# (served by whichever worker gets it) sums the files of all workers, so the
+# numbers cover the whole service. When a worker exits, gunicorn.conf.py folds
+# its last values into archive.json so counters never go backwards; the master
+# clears the directory when it starts.
+import os
+import json
+import time
+import threading
+
+METRICS_DIR = os.environ.get("DWP_METRICS_DIR", "metrics")
+SNAPSHOT_INTERVAL = 5 # Seconds between a worker's snapshot writes
+ARCHIVE_FILE = "archive.json" # Totals of exited workers
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {} # labels -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), list(counts)] for key, counts in self._values.items()]
+
+
+class Registry:
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self._metrics = {}
+        self._process_collectors = [] # fn() -> [(name, help, labels, value)]: per-process counters read on snapshot
+        self._scrape_collectors = [] # fn() -> [(name, type, help, labels, value)]: service-wide values read on scrape
+        self._writer = None
+        self._instance = None # (pid, snapshot file name) of the process writing
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def add_process_collector(self, fn):
+        """fn returns counters this process already keeps elsewhere, as (name, help, labels, value)."""
+        self._process_collectors.append(fn)
+
+    def add_scrape_collector(self, fn):
+        """fn returns gauges that describe the whole service (e.g. queue depth), read once per scrape."""
+        self._scrape_collectors.append(fn)
+
+    # --- per-process snapshots ---
+    def snapshot(self):
+        data = {}
+        for metric in list(self._metrics.values()):
+            entry = {"type": metric.type, "help": metric.help, "samples": metric.samples()}
+            if metric.type == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            data[metric.name] = entry
+        for collector in self._process_collectors:
+            try:
+                rows = collector()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, help_text, labels, value in rows:
+                entry = data.setdefault(name, {"type": "counter", "help": help_text, "samples": []})
+                entry["samples"].append([list(_label_key(labels)), value])
+        return data
+
+    def _snapshot_name(self):
+        pid = os.getpid()
+        if self._instance is None or self._instance[0] != pid: # First write, or a forked child
+            self._instance = (pid, f"{pid}-{int(time.time() * 1000)}.json")
+        return self._instance[1]
+
+    def write_snapshot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_json(os.path.join(self.directory, self._snapshot_name()), self.snapshot())
+
+    def ensure_writer(self):
+        """Start the thread that keeps this process's snapshot file current."""
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"Error writing metrics snapshot: {e}")
+            time.sleep(SNAPSHOT_INTERVAL)
+
+    # --- scrape ---
+    def collect(self):
+        """Sum of every worker's latest snapshot (this process's taken fresh)."""
+        self.write_snapshot()
+        merged = {}
+        # The archive is read first: a worker file folded into it after that
+        # point is still counted once, from the file itself
+        archive = _read_json(os.path.join(self.directory, ARCHIVE_FILE)) or {}
+        folded = set(archive.get("folded", ()))
+        _merge_snapshot(merged, archive.get("metrics", {}))
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json") or filename == ARCHIVE_FILE or filename in folded:
+                continue
+            # None while being replaced; its values show up next scrape
+            _merge_snapshot(merged, _read_json(os.path.join(self.directory, filename)) or {})
+        for collector in self._scrape_collectors:
+            try:
+                rows = collector()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, metric_type, help_text, labels, value in rows:
+                entry = merged.setdefault(name, {"type": metric_type, "help": help_text, "samples": {}})
+                entry["samples"][_label_key(labels)] = value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, entry in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            for labels, value in sorted(entry["samples"].items()):
+                if entry["type"] == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(list(entry["buckets"]) + ["+Inf"], value[:-1]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value[-1]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _merge_snapshot(merged, snapshot):
+    """Add a snapshot's samples into merged ({name: entry with samples keyed by label tuples})."""
+    for name, entry in snapshot.items():
+        target = merged.setdefault(name, {**entry, "samples": {}})
+        for labels, value in entry["samples"]:
+            key = tuple(tuple(pair) for pair in labels)
+            if isinstance(value, list):
+                current = target["samples"].get(key)
+                target["samples"][key] = [a + b for a, b in zip(current, value)] if current else value
+            else:
+                target["samples"][key] = target["samples"].get(key, 0) + value
+
+
+def archive_worker(pid, directory=METRICS_DIR):
+    """
+    Fold an exited worker's snapshot files into the archive, then delete them.
+    Called by the gunicorn master only, so there is a single archive writer.
+    """
+    try:
+        names = [f for f in os.listdir(directory) if f.startswith(f"{pid}-") and f.endswith(".json")]
+    except OSError:
+        return
+    if not names:
+        return
+    path = os.path.join(directory, ARCHIVE_FILE)
+    archive = _read_json(path) or {}
+    merged = {}
+    _merge_snapshot(merged, archive.get("metrics", {}))
+    for name in names:
+        _merge_snapshot(merged, _read_json(os.path.join(directory, name)) or {})
+    existing = set(os.listdir(directory))
+    folded = [f for f in archive.get("folded", ()) if f in existing] + names
+    metrics = {
+        name: {**entry, "samples": [[[list(pair) for pair in key], value] for key, value in entry["samples"].items()]}
+        for name, entry in merged.items()
+    }
+    # Write the archive (listing the files it now includes) before deleting them,
+    # so a scrape in between counts each value exactly once
+    _write_json(path, {"metrics": metrics, "folded": folded})
+    for name in names:
+        os.remove(os.path.join(directory, name))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def clear(directory=METRICS_DIR):
+    """Forget all snapshot files, e.g. when the whole service restarts."""
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+
+
+registry = Registry()
+
+# Metrics recorded from several modules
+REQUEST_SECONDS = registry.histogram("dwp_http_request_duration_seconds", "Time to handle a web request, by route.")
+PLAYER_CACHE_LOOKUPS = registry.counter("dwp_player_cache_lookups_total", "Player skin cache lookups by result (fresh, stale, unknown).")
+UPSTREAM_SECONDS = registry.histogram("dwp_upstream_request_duration_seconds", "Outbound HTTP request time, by host.")
+DB_SECONDS = registry.histogram("dwp_db_operation_duration_seconds", "Database connection opens, execute() calls and write transactions.")
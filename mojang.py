@@ -0,0 +1,86 @@
+# mojang.py
+# Name -> UUID/profile resolution against the Mojang API. Names are looked up in
+# batches through the bulk profile endpoint and the per-UUID profile fetches run
+# on a bounded thread pool. Base URLs can be pointed at a local stub for testing.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import client
+
+MOJANG_API_URL = os.environ.get("MOJANG_API_URL", "https://api.mojang.com")
+MOJANG_SESSION_URL = os.environ.get("MOJANG_SESSION_URL", "https://sessionserver.mojang.com")
+BULK_LOOKUP_SIZE = 10 # Mojang's limit for names per bulk request
+RESOLVE_WORKERS = 8 # Concurrent requests to Mojang per process
+
+_executor = ThreadPoolExecutor(max_workers=RESOLVE_WORKERS, thread_name_prefix="mojang")
+
+
+def lookup_uuids(names):
+    """
+    Bulk name -> profile lookup for up to BULK_LOOKUP_SIZE names.
+    Returns {lowercased name: {"id": uuid, "name": current name}}; names Mojang
+    doesn't know are simply absent. Raises on HTTP/network errors.
+    """
+    # Safe to retry: the bulk lookup doesn't change anything on Mojang's side
+    response = client.post(f"{MOJANG_API_URL}/profiles/minecraft", json=list(names), retries=2)
+    response.raise_for_status()
+    return {profile["name"].lower(): profile for profile in response.json()}
+
+
+def lookup_uuid(name):
+    """{"uuid": ..., "name": current name} for one username, or None if Mojang has no such player."""
+    profile = lookup_uuids([name]).get(name.lower())
+    return {"uuid": profile["id"], "name": profile["name"]} if profile else None
+
+
+def fetch_profile(uuid):
+    """Full session profile (skin textures etc.) for a UUID, or None."""
+    response = client.get(f"{MOJANG_SESSION_URL}/session/minecraft/profile/{uuid}")
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+
+def _resolve_batch(names):
+    found = lookup_uuids(names)
+    results = {}
+    for name in names:
+        profile = found.get(name.lower())
+        results[name] = {"uuid": profile["id"], "name": profile["name"]} if profile else None
+    return results
+
+
+def _attach_profile(player_data):
+    try:
+        profile = fetch_profile(player_data["uuid"])
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching profile for {player_data['name']}: {e}")
+        profile = None
+    if profile:
+        player_data["name"] = profile.get("name", player_data["name"])
+        player_data["profile"] = profile # Contains skin data if needed
+    return player_data
+
+
+def resolve_players(names, with_profile=True):
+    """
+    Resolve many usernames concurrently. Returns {name: player_data}, where
+    player_data is None for names Mojang reports as nonexistent. Names whose
+    batch failed (network error, rate limit) are left out so callers don't
+    cache a wrong answer.
+    """
+    names = list(dict.fromkeys(names))
+    batches = [names[i:i + BULK_LOOKUP_SIZE] for i in range(0, len(names), BULK_LOOKUP_SIZE)]
+    results = {}
+    for batch, future in [(batch, _executor.submit(_resolve_batch, batch)) for batch in batches]:
+        try:
+            results.update(future.result())
+        except Exception as e:
+            print(f"Error resolving Mojang names {batch}: {e}")
+
+    if with_profile:
+        found = [data for data in results.values() if data]
+        list(_executor.map(_attach_profile, found)) # Fills in each dict in place
+    return results
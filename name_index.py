@@ -0,0 +1,100 @@
+# name_index.py
+# In-memory index over linked Minecraft names for slash-command autocomplete and
+# typo-tolerant search. Exact lookups go straight to the idx_links_name_id SQL index
+# (database.find_links_by_name); this index serves prefix and trigram queries and
+# is rebuilt only when the links change counter moves.
+import bisect
+import threading
+from collections import defaultdict
+
+from database import get_backend, get_change_version
+
+MAX_RESULTS = 25 # Discord shows at most 25 autocomplete choices
+
+
+def trigrams(name):
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._sorted = [] # (lowercased name, minecraft_name, discord_id), sorted
+        self._names = {} # lowercased name -> [(minecraft_name, discord_id)]
+        self._trigrams = defaultdict(set) # trigram -> {lowercased name}
+
+    def _refresh(self):
+        version = get_change_version("links")
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            rows = get_backend().execute("SELECT discord_id, minecraft_name FROM links").fetchall()
+            entries = sorted((name.lower(), name, discord_id) for discord_id, name in rows)
+            names = defaultdict(list)
+            grams = defaultdict(set)
+            for lower, name, discord_id in entries:
+                names[lower].append((name, discord_id))
+                for gram in trigrams(lower):
+                    grams[gram].add(lower)
+            self._sorted, self._names, self._trigrams = entries, dict(names), grams
+            self._version = version
+
+    def lookup(self, minecraft_name):
+        """Exact case-insensitive match: [(minecraft_name, discord_id)]."""
+        self._refresh()
+        return list(self._names.get(minecraft_name.lower(), []))
+
+    def prefix(self, prefix, limit=MAX_RESULTS):
+        """Names starting with prefix (case-insensitive), in alphabetical order."""
+        self._refresh()
+        prefix = prefix.lower()
+        entries = self._sorted
+        start = bisect.bisect_left(entries, (prefix,))
+        results = []
+        seen = set()
+        for i in range(start, len(entries)):
+            lower, name, _ = entries[i]
+            if not lower.startswith(prefix) or len(results) >= limit:
+                break
+            if lower not in seen:
+                seen.add(lower)
+                results.append(name)
+        return results
+
+    def fuzzy(self, query, limit=MAX_RESULTS, min_score=0.2):
+        """Names sharing enough trigrams with query, best match first."""
+        self._refresh()
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for lower in self._trigrams.get(gram, ()):
+                shared[lower] += 1
+        scored = []
+        for lower, count in shared.items():
+            score = count / len(query_grams | trigrams(lower))
+            if score >= min_score:
+                scored.append((-score, abs(len(lower) - len(query)), lower))
+        scored.sort()
+        return [self._names[lower][0][0] for _, _, lower in scored[:limit]]
+
+    def complete(self, current, limit=MAX_RESULTS):
+        """Autocomplete: prefix matches first, topped up with fuzzy matches."""
+        if not current:
+            return self.prefix("", limit)
+        results = self.prefix(current, limit)
+        if len(results) < limit:
+            for name in self.fuzzy(current, limit):
+                if name not in results:
+                    results.append(name)
+                    if len(results) >= limit:
+                        break
+        return results
+
+
+name_index = NameIndex()
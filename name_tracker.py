@@ -0,0 +1,70 @@
+# name_tracker.py
+# Keeps the Minecraft identity of each link current. Links carry the account
+# UUID captured when they were made; this job asks Mojang for the current name
+# of a few links at a time, least recently checked first, and applies renames
+# (which reach the website as roster "rename" events). Links made before UUIDs
+# were stored, or whose lookup failed at link time, get their UUID here.
+# Runs from the bot on a timer; the website only ever reads the stored values.
+import os
+import time
+
+import requests
+
+from database import get_links_due_for_name_check, record_link_identity, mark_links_name_checked
+from mojang import lookup_uuids, fetch_profile, BULK_LOOKUP_SIZE
+
+NAME_CHECK_INTERVAL = int(os.environ.get("DWP_NAME_CHECK_INTERVAL", 24 * 3600)) # Seconds between checks of one link
+NAME_CHECKS_PER_RUN = 60 # Links looked at per run of the bot's task
+PROFILE_FETCH_DELAY = 1.0 # Seconds between profile requests, to stay far below Mojang's rate limit
+
+
+def _resolve_missing(rows, report):
+    """Links without a UUID: resolve their names in bulk."""
+    for i in range(0, len(rows), BULK_LOOKUP_SIZE):
+        batch = rows[i:i + BULK_LOOKUP_SIZE]
+        found = lookup_uuids([name for _, name, _ in batch])
+        unknown = []
+        for discord_id, name, _ in batch:
+            profile = found.get(name.lower())
+            if profile is None:
+                unknown.append(discord_id) # No such player (yet); try again next interval
+                continue
+            # Keep the casing the link was made with unless Mojang's differs in more than case
+            current = name if profile["name"].lower() == name.lower() else profile["name"]
+            record_link_identity(discord_id, current, profile["id"])
+            report["resolved"] += 1
+        mark_links_name_checked(unknown)
+        report["checked"] += len(batch)
+
+
+def _check_names(rows, report):
+    """Links with a UUID: fetch the account's current name."""
+    for discord_id, name, uuid in rows:
+        profile = fetch_profile(uuid)
+        if profile and profile.get("name"):
+            current = profile["name"]
+            if current.lower() != name.lower():
+                print(f"Minecraft account {uuid} renamed: {name} -> {current}")
+                record_link_identity(discord_id, current, uuid)
+                report["renamed"] += 1
+            else:
+                record_link_identity(discord_id, name, uuid)
+        else:
+            mark_links_name_checked([discord_id])
+        report["checked"] += 1
+        time.sleep(PROFILE_FETCH_DELAY)
+
+
+def sync_link_identities(limit=NAME_CHECKS_PER_RUN):
+    """
+    Check up to `limit` links that are due. Stops early on network errors so
+    the remaining links are retried next run. Returns counts of what it did.
+    """
+    report = {"checked": 0, "resolved": 0, "renamed": 0}
+    rows = get_links_due_for_name_check(time.time() - NAME_CHECK_INTERVAL, limit)
+    try:
+        _resolve_missing([row for row in rows if not row[2]], report)
+        _check_names([row for row in rows if row[2]], report)
+    except requests.exceptions.RequestException as e:
+        print(f"Name tracking paused after a Mojang error: {e}")
+    return report
@@ -0,0 +1,52 @@
+# notify.py
+# Local wake-up channel from the webapp to the bot. The webapp sends a datagram
+# on a Unix domain socket after queueing an application; the bot listens on it
+# and drains the queue straight away instead of waiting for its next poll.
+import os
+import socket
+import asyncio
+
+NOTIFY_SOCKET = os.environ.get("DWP_NOTIFY_SOCKET", "mydb.notify.sock") # Next to the database by default
+
+
+def notify_bot(message=b"applications"):
+    """
+    Wake the bot. Never raises or blocks: if the bot is not listening it will
+    still find the work on its fallback poll. Returns True if the datagram was sent.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(message, NOTIFY_SOCKET)
+        return True
+    except OSError:
+        return False
+
+
+class _NotifyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        self.callback(data)
+
+
+async def listen(callback, path=NOTIFY_SOCKET):
+    """
+    Bind the notification socket and call callback(message) for every datagram.
+    Returns the transport, or None when Unix sockets are unavailable.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        print("Unix domain sockets not supported here; relying on polling for new applications.")
+        return None
+    if os.path.exists(path):
+        os.unlink(path) # Left over from a previous run
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    os.chmod(path, 0o660) # The webapp may run as a different user in the same group
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _NotifyProtocol(callback), sock=sock)
+    print(f"Listening for application notifications on {path}")
+    return transport
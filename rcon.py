@@ -0,0 +1,267 @@
+# rcon.py
+# asyncio client for the Minecraft RCON protocol. Connections are opened and
+# authenticated once and kept in a small pool, so a command costs one round
+# trip instead of a TCP handshake plus login. Each connection has a reader task
+# that routes response packets to waiting commands by request ID; a command
+# that timed out has its late reply dropped instead of handed to the next one.
+# The vanilla server reads one packet at a time per connection, so each
+# connection carries one command at a time and the pool provides concurrency.
+# Failed connects back off exponentially so an unreachable server costs an
+# immediate error, not a stalled slash command.
+import os
+import time
+import random
+import struct
+import asyncio
+import itertools
+
+from config import config
+
+POOL_SIZE = int(os.environ.get("DWP_RCON_POOL_SIZE", 2)) # Open connections kept to the server
+CONNECT_TIMEOUT = 5 # Seconds for TCP connect plus login
+COMMAND_TIMEOUT = float(os.environ.get("DWP_RCON_TIMEOUT", 10)) # Default seconds to wait for a command's reply
+BACKOFF_INITIAL = 1 # Seconds to wait after the first failed connect
+BACKOFF_MAX = 60 # Longest wait between connect attempts
+FRAGMENT_SIZE = 4096 # The server splits longer replies into packets of this size
+FRAGMENT_GRACE = 0.2 # Seconds to wait for another fragment after a full-size one
+
+# Packet types
+TYPE_RESPONSE = 0
+TYPE_COMMAND = 2
+TYPE_LOGIN = 3
+
+
+class RconError(Exception):
+    pass
+
+
+class RconAuthError(RconError):
+    pass
+
+
+def encode_packet(request_id, packet_type, body):
+    payload = struct.pack("<ii", request_id, packet_type) + body.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(payload)) + payload
+
+
+class RconConnection:
+    """One authenticated connection. Use RconClient rather than this directly."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._pending = {} # request ID -> [future, fragments, grace timer]
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self.closed = False
+        self.timed_out = False
+
+    @classmethod
+    async def open(cls, host, port, password, timeout=CONNECT_TIMEOUT):
+        async def connect():
+            reader, writer = await asyncio.open_connection(host, port)
+            conn = cls(reader, writer)
+            try:
+                await conn.login(password)
+            except BaseException:
+                conn.close()
+                raise
+            return conn
+        return await asyncio.wait_for(connect(), timeout)
+
+    def _next_id(self):
+        request_id = next(self._ids)
+        if request_id >= 2 ** 31 - 1:
+            self._ids = itertools.count(1)
+            request_id = next(self._ids)
+        return request_id
+
+    async def _read_loop(self):
+        error = RconError("RCON connection closed")
+        try:
+            while True:
+                (length,) = struct.unpack("<i", await self._reader.readexactly(4))
+                data = await self._reader.readexactly(length)
+                request_id, _ = struct.unpack("<ii", data[:8])
+                self._dispatch(request_id, data[8:-2].decode("utf-8", "replace"))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, struct.error) as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                error = RconError(f"RCON connection lost: {e}")
+        finally:
+            self.close(error)
+
+    def _dispatch(self, request_id, body):
+        if request_id == -1: # The server's answer to a wrong password
+            for entry in self._pending.values():
+                if not entry[0].done():
+                    entry[0].set_exception(RconAuthError("RCON password rejected"))
+            return
+        entry = self._pending.get(request_id)
+        if entry is None:
+            return # Reply to a command that already timed out
+        future, fragments, timer = entry
+        fragments.append(body)
+        if timer is not None:
+            timer.cancel()
+            entry[2] = None
+        if len(body.encode("utf-8")) >= FRAGMENT_SIZE:
+            # Possibly more to come; finish if nothing follows shortly
+            entry[2] = asyncio.get_running_loop().call_later(FRAGMENT_GRACE, self._finish, request_id)
+        else:
+            self._finish(request_id)
+
+    def _finish(self, request_id):
+        entry = self._pending.pop(request_id, None)
+        if entry is not None and not entry[0].done():
+            entry[0].set_result("".join(entry[1]))
+
+    async def _request(self, packet_type, body, timeout):
+        if self.closed:
+            raise RconError("RCON connection closed")
+        request_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = [future, [], None]
+        try:
+            self._writer.write(encode_packet(request_id, packet_type, body))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            entry = self._pending.pop(request_id, None)
+            if entry is not None and entry[2] is not None:
+                entry[2].cancel()
+
+    async def login(self, password):
+        await self._request(TYPE_LOGIN, password, CONNECT_TIMEOUT)
+
+    async def command(self, command, timeout=COMMAND_TIMEOUT):
+        try:
+            return await self._request(TYPE_COMMAND, command, timeout)
+        except asyncio.TimeoutError:
+            # The server is still busy with it; don't give this connection to the next command
+            self.timed_out = True
+            self.close(RconError("RCON command timed out"))
+            raise RconError(f"RCON command timed out after {timeout:g}s") from None
+
+    def close(self, error=None):
+        if self.closed:
+            return
+        self.closed = True
+        for future, _, timer in self._pending.values():
+            if timer is not None:
+                timer.cancel()
+            if not future.done():
+                future.set_exception(error or RconError("RCON connection closed"))
+        self._pending.clear()
+        self._writer.close()
+        if self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+
+
+class RconClient:
+    """
+    Pool of RCON connections to the server in config (re-read on every command,
+    so /set_rcon_details takes effect without a restart).
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = []
+        self._slots = None
+        self._settings = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._last_error = None
+
+    def _current_settings(self):
+        settings = config.current()
+        if not all([settings.rcon_host, settings.rcon_port, settings.rcon_password]):
+            raise RconError("RCON settings not fully configured.")
+        current = (settings.rcon_host, int(settings.rcon_port), settings.rcon_password)
+        if current != self._settings:
+            self.close()
+            self._settings = current
+            self._failures = 0
+            self._retry_at = 0.0
+        return current
+
+    async def _connect(self):
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise RconError(f"{self._last_error} (retrying in {self._retry_at - now:.0f}s)")
+        host, port, password = self._settings
+        try:
+            conn = await RconConnection.open(host, port, password)
+        except (OSError, asyncio.TimeoutError, RconError) as e:
+            if isinstance(e, ConnectionRefusedError):
+                message = "RCON connection refused. Is the server running and RCON enabled?"
+            elif isinstance(e, asyncio.TimeoutError):
+                message = f"RCON server {host}:{port} did not answer within {CONNECT_TIMEOUT}s"
+            else:
+                message = str(e) or type(e).__name__
+            self._failures += 1
+            delay = min(BACKOFF_INITIAL * 2 ** (self._failures - 1), BACKOFF_MAX)
+            self._retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+            self._last_error = message
+            print(f"RCON connect to {host}:{port} failed ({message}); next attempt in {delay}s")
+            raise RconError(message) from e
+        if self._failures:
+            print(f"RCON reconnected to {host}:{port}")
+        self._failures = 0
+        return conn
+
+    async def command(self, command, timeout=COMMAND_TIMEOUT):
+        """Run a console command and return its output. Raises RconError."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            settings = self._current_settings()
+            # A pooled connection may have been closed by the server since its last
+            # use; such a command never reached it, so try once more on a fresh one.
+            for attempt in range(2):
+                conn = None
+                while self._idle and conn is None:
+                    candidate = self._idle.pop()
+                    conn = None if candidate.closed else candidate
+                reused = conn is not None
+                if conn is None:
+                    conn = await self._connect()
+                try:
+                    result = await conn.command(command, timeout)
+                except (ConnectionError, OSError) as e:
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise RconError(f"RCON connection lost: {e}") from e
+                except RconError:
+                    if reused and attempt == 0 and conn.closed and not conn.timed_out:
+                        continue
+                    raise
+                except BaseException:
+                    # Cancelled mid-command: the reply may still arrive, so don't reuse it
+                    conn.close()
+                    raise
+                if not conn.closed and self._settings == settings:
+                    self._idle.append(conn)
+                else:
+                    conn.close()
+                return result
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+
+
+client = RconClient()
+
+
+async def execute(command, timeout=COMMAND_TIMEOUT):
+    """
+    Run a command through the shared client, as {"status": "success"|"error",
+    "message": ...}, the shape the bot's commands report back to Discord.
+    """
+    try:
+        return {"status": "success", "message": await client.command(command, timeout)}
+    except RconError as e:
+        print(f"RCON Error: {e}")
+        return {"status": "error", "message": str(e)}
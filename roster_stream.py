@@ -0,0 +1,148 @@
+# roster_stream.py
+# Server-Sent Events for live roster updates. Triggers on links append every
+# add/remove/rename to roster_events; one poller thread per process watches that
+# table and wakes the open streams, which send only the new rows. Streams end
+# after a bounded time and browsers reconnect with Last-Event-ID, so nothing is
+# missed. Under thread workers only a few streams run per process (the rest are
+# told to retry later); gevent workers can hold many.
+import os
+import json
+import time
+import threading
+from collections import deque
+
+from database import get_roster_events, get_roster_event_bounds, get_link_uuid, peek_player_skin
+
+POLL_INTERVAL = 1.0 # Seconds between checks for new roster events
+HEARTBEAT_INTERVAL = 15 # Keeps proxies from closing an idle stream
+STREAM_LIFETIME = 300 # Seconds before a stream ends and the browser reconnects
+RETRY_MS = 3000 # Reconnect delay browsers use after a stream ends
+BUSY_RETRY_MS = 30000 # Reconnect delay when this process has no stream slots free
+RECENT_EVENTS = 1000 # Events kept in memory for streams to catch up from
+
+
+def _cooperative_worker():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def _default_max_streams():
+    return 1000 if _cooperative_worker() else 4
+
+
+class RosterBroadcaster:
+    def __init__(self, max_streams=None):
+        self.max_streams = max_streams
+        self._recent = deque(maxlen=RECENT_EVENTS)
+        self._latest_id = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._streams = 0
+
+    def ensure_started(self):
+        with self._cond:
+            if self.max_streams is None:
+                self.max_streams = int(os.environ.get("DWP_ROSTER_MAX_STREAMS", _default_max_streams()))
+            if self._thread is None or not self._thread.is_alive():
+                self._latest_id = get_roster_event_bounds()[1]
+                self._thread = threading.Thread(target=self._run, name="roster-broadcaster", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                events = get_roster_events(self._latest_id)
+                if events:
+                    with self._cond:
+                        self._recent.extend(events)
+                        self._latest_id = events[-1]["id"]
+                        self._cond.notify_all()
+            except Exception as e:
+                print(f"Roster broadcaster error: {e}")
+
+    def _events_after(self, last_id):
+        """New events for a stream, from memory when possible."""
+        with self._cond:
+            if self._recent and self._recent[0]["id"] <= last_id + 1:
+                return [event for event in self._recent if event["id"] > last_id]
+            if last_id >= self._latest_id:
+                return []
+        return get_roster_events(last_id)
+
+    def _wait(self, last_id, timeout):
+        with self._cond:
+            if self._latest_id <= last_id:
+                self._cond.wait(timeout)
+
+    def try_acquire(self):
+        with self._cond:
+            if self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._streams -= 1
+
+    def stream(self, last_event_id=None):
+        """
+        SSE text chunks. Without last_event_id the stream starts at the newest
+        event; with one it first replays what the client missed, or sends a
+        "reset" event when that history has been pruned.
+        """
+        self.ensure_started()
+        # The slot is taken inside the generator so it is always given back:
+        # a generator that never started would skip its finally block
+        if not self.try_acquire():
+            yield f"retry: {BUSY_RETRY_MS}\n\n"
+            return
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            oldest, newest = get_roster_event_bounds()
+            if last_event_id is None or last_event_id > newest:
+                last_id = newest
+            elif oldest is not None and last_event_id < oldest - 1:
+                # Events the client missed are gone; it has to reload the list
+                yield format_event("reset", {"id": newest}, newest)
+                last_id = newest
+            else:
+                last_id = last_event_id
+
+            deadline = time.monotonic() + STREAM_LIFETIME
+            last_sent = time.monotonic()
+            while time.monotonic() < deadline:
+                events = self._events_after(last_id)
+                for event in events:
+                    yield format_event("roster", with_uuid(event), event["id"])
+                    last_id = event["id"]
+                if events:
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                    yield ": heartbeat\n\n"
+                    last_sent = time.monotonic()
+                self._wait(last_id, min(HEARTBEAT_INTERVAL, max(deadline - time.monotonic(), 0)))
+        finally:
+            self.release()
+
+
+def with_uuid(event):
+    """Attach the link's UUID (or the cached one) so the page can show the face; never calls Mojang."""
+    if event["type"] == "remove":
+        return event
+    uuid = get_link_uuid(event["discord_id"])
+    if uuid:
+        return {**event, "uuid": uuid}
+    _, player_data = peek_player_skin(event["name"])
+    return {**event, "uuid": player_data["uuid"]} if player_data else event
+
+
+def format_event(name, data, event_id):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+broadcaster = RosterBroadcaster()
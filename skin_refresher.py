@@ -0,0 +1,121 @@
+# skin_refresher.py
+# Background refresher for the player skin cache (stale-while-revalidate).
+# Request threads only read the cache and hand unknown names to this thread;
+# it refreshes entries shortly before they expire, soonest first, at a bounded
+# rate. With several gunicorn workers only the one holding the refresher lock
+# talks to Mojang; the others serve whatever the cache holds.
+import os
+import time
+import heapq
+import threading
+
+from database import SQLITE_FILE, cache_player_skins, get_players_due_for_refresh
+from mojang import resolve_players, BULK_LOOKUP_SIZE
+
+try:
+    import fcntl
+except ImportError: # Windows: every worker refreshes
+    fcntl = None
+
+REFRESH_AHEAD = 600 # Refresh entries this many seconds before they expire
+REFRESH_SCAN_INTERVAL = 30 # Seconds between scans of links for entries due a refresh
+REFRESH_BATCHES_PER_SECOND = 5 # Rate limit towards Mojang (each batch is up to 10 names)
+LOCK_FILE = f"{SQLITE_FILE}.refresher.lock"
+
+
+class SkinRefresher:
+    def __init__(self):
+        self._heap = [] # (priority, name); lower priority runs first
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._lock_file = None
+        self._last_scan = 0.0
+        self.refreshed = 0
+        self.failed_batches = 0
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="skin-refresher", daemon=True)
+                self._thread.start()
+
+    def request(self, names):
+        """Ask for names that have no cache entry at all; they jump the queue."""
+        self.ensure_started()
+        with self._cond:
+            for name in names:
+                self._push(0, name)
+            self._cond.notify()
+
+    def _push(self, priority, name):
+        key = name.lower()
+        if key not in self._queued:
+            self._queued.add(key)
+            heapq.heappush(self._heap, (priority, name))
+
+    def _pop_batch(self):
+        batch = []
+        while self._heap and len(batch) < BULK_LOOKUP_SIZE:
+            _, name = heapq.heappop(self._heap)
+            self._queued.discard(name.lower())
+            batch.append(name)
+        return batch
+
+    def _acquire_lock(self):
+        """Only one process refreshes; the lock is released when that process exits."""
+        if fcntl is None or self._lock_file is not None:
+            return True
+        lock_file = open(LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        print(f"Skin refresher active in process {os.getpid()}")
+        return True
+
+    def _scan(self):
+        self._last_scan = time.monotonic()
+        due = get_players_due_for_refresh(REFRESH_AHEAD)
+        with self._cond:
+            for name, expires_at in due:
+                self._push(expires_at, name)
+
+    def _run(self):
+        interval = 1.0 / REFRESH_BATCHES_PER_SECOND
+        while True:
+            try:
+                if not self._acquire_lock():
+                    with self._cond:
+                        self._heap.clear()
+                        self._queued.clear()
+                    time.sleep(REFRESH_SCAN_INTERVAL) # Take over if the active worker goes away
+                    continue
+                if time.monotonic() - self._last_scan >= REFRESH_SCAN_INTERVAL:
+                    self._scan()
+                with self._cond:
+                    if not self._heap:
+                        timeout = REFRESH_SCAN_INTERVAL - (time.monotonic() - self._last_scan)
+                        self._cond.wait(max(timeout, 0))
+                    batch = self._pop_batch()
+                if batch:
+                    self._refresh(batch)
+                    time.sleep(interval)
+            except Exception as e:
+                print(f"Skin refresher error: {e}")
+                time.sleep(5)
+
+    def _refresh(self, batch):
+        results = resolve_players(batch, with_profile=False)
+        if len(results) < len(batch):
+            self.failed_batches += 1 # Left stale; picked up again on the next scan
+        if results:
+            cache_player_skins(results)
+            self.refreshed += len(results)
+
+
+refresher = SkinRefresher()
@@ -0,0 +1,607 @@
+# storage.py
+import os
+import dbm
+import json
+import pickle
+import shelve
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import DB_SECONDS
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+BUSY_TIMEOUT = float(os.environ.get("DWP_DB_BUSY_TIMEOUT", 10)) # Seconds a statement waits for another writer; keep well under gunicorn's timeout
+POOL_CONNECTIONS = 10 # Connections per gevent worker (gevent's threadpool runs 10 threads by default)
+
+
+def gevent_threadpool():
+    """
+    gevent's pool of real OS threads when this process runs monkey-patched
+    (gunicorn gevent workers), else None. sqlite3 is C code that gevent can't
+    switch away from, so waits for SQLite's write lock must happen there.
+    """
+    try:
+        from gevent import monkey, get_hub
+    except ImportError:
+        return None
+    return get_hub().threadpool if monkey.is_module_patched("socket") else None
+
+# Tables holding one row per record. Everything else (bot token, RCON settings,
+# managed roles, ...) lives in the generic `kv` table as pickled values, the same
+# way shelve stored it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS links (
+    discord_id TEXT PRIMARY KEY,
+    minecraft_name TEXT NOT NULL,
+    uuid TEXT, -- Mojang account ID (no dashes); NULL until resolved
+    name_checked_at REAL -- When name_tracker last confirmed the name for this UUID
+);
+-- Name order with discord_id as tie-breaker: exact lookups and keyset pages of the players API
+DROP INDEX IF EXISTS idx_links_name;
+CREATE INDEX IF NOT EXISTS idx_links_name_id ON links (minecraft_name COLLATE NOCASE, discord_id);
+CREATE TABLE IF NOT EXISTS user_notes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_key TEXT NOT NULL,
+    note TEXT NOT NULL,
+    author TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_user_notes_user ON user_notes (user_key, id);
+CREATE TABLE IF NOT EXISTS user_flags (
+    user_key TEXT PRIMARY KEY,
+    flag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS applications (
+    message_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS player_cache (
+    username TEXT PRIMARY KEY,
+    data TEXT,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_player_cache_timestamp ON player_cache (timestamp);
+-- Lets the avatar proxy check that a UUID belongs to a player we know of
+CREATE INDEX IF NOT EXISTS idx_player_cache_uuid ON player_cache (json_extract(data, '$.uuid'));
+CREATE TABLE IF NOT EXISTS application_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_application_queue_visible ON application_queue (visible_at, id);
+CREATE TABLE IF NOT EXISTS application_dead_letter (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated ON rate_limits (updated_at);
+
+-- Bumped by triggers on every write, so readers can cheaply tell whether
+-- something derived from a table (name index, cached API payloads) is stale.
+CREATE TABLE IF NOT EXISTS change_counters (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO change_counters (name, version) VALUES ('links', 0), ('player_cache', 0);
+CREATE TRIGGER IF NOT EXISTS links_insert_counter AFTER INSERT ON links BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'links';
+END;
+-- Only columns the website shows; name_tracker's check timestamps don't invalidate cached lists
+CREATE TRIGGER IF NOT EXISTS links_update_counter AFTER UPDATE OF discord_id, minecraft_name, uuid ON links BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'links';
+END;
+CREATE TRIGGER IF NOT EXISTS links_delete_counter AFTER DELETE ON links BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'links';
+END;
+-- Append-only log of roster changes for the website's live event stream,
+-- written by triggers so changes made by the bot or db_tool are included.
+CREATE TABLE IF NOT EXISTS roster_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL, -- add, remove or rename
+    discord_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    old_name TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS links_insert_event AFTER INSERT ON links BEGIN
+    INSERT INTO roster_events (kind, discord_id, name, created_at)
+    VALUES ('add', new.discord_id, new.minecraft_name, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS links_update_event AFTER UPDATE ON links
+WHEN old.minecraft_name IS NOT new.minecraft_name BEGIN
+    INSERT INTO roster_events (kind, discord_id, name, old_name, created_at)
+    VALUES ('rename', new.discord_id, new.minecraft_name, old.minecraft_name, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS links_delete_event AFTER DELETE ON links BEGIN
+    INSERT INTO roster_events (kind, discord_id, name, created_at)
+    VALUES ('remove', old.discord_id, old.minecraft_name, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS player_cache_insert_counter AFTER INSERT ON player_cache BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'player_cache';
+END;
+CREATE TRIGGER IF NOT EXISTS player_cache_update_counter AFTER UPDATE ON player_cache BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'player_cache';
+END;
+CREATE TRIGGER IF NOT EXISTS player_cache_delete_counter AFTER DELETE ON player_cache BEGIN
+    UPDATE change_counters SET version = version + 1 WHERE name = 'player_cache';
+END;
+"""
+
+# Databases created before links carried UUIDs: add the columns and narrow the
+# update counter trigger (SCHEMA recreates it afterwards).
+LINKS_UUID_MIGRATION = """
+BEGIN;
+ALTER TABLE links ADD COLUMN uuid TEXT;
+ALTER TABLE links ADD COLUMN name_checked_at REAL;
+DROP TRIGGER IF EXISTS links_update_counter;
+COMMIT;
+"""
+
+# Links without a UUID take the one the player cache already knows, so
+# name_tracker only has to resolve the rest
+LINKS_UUID_BACKFILL = """
+UPDATE links SET uuid = (
+    SELECT json_extract(c.data, '$.uuid') FROM player_cache c WHERE c.username = lower(links.minecraft_name)
+)
+WHERE uuid IS NULL AND EXISTS (
+    SELECT 1 FROM player_cache c
+    WHERE c.username = lower(links.minecraft_name) AND json_extract(c.data, '$.uuid') IS NOT NULL
+)
+"""
+
+NOTES_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE user_notes_fts USING fts5(note, content='user_notes', content_rowid='id');
+CREATE TRIGGER user_notes_fts_insert AFTER INSERT ON user_notes BEGIN
+    INSERT INTO user_notes_fts (rowid, note) VALUES (new.id, new.note);
+END;
+CREATE TRIGGER user_notes_fts_delete AFTER DELETE ON user_notes BEGIN
+    INSERT INTO user_notes_fts (user_notes_fts, rowid, note) VALUES ('delete', old.id, old.note);
+END;
+CREATE TRIGGER user_notes_fts_update AFTER UPDATE ON user_notes BEGIN
+    INSERT INTO user_notes_fts (user_notes_fts, rowid, note) VALUES ('delete', old.id, old.note);
+    INSERT INTO user_notes_fts (rowid, note) VALUES (new.id, new.note);
+END;
+"""
+
+
+class DBStats:
+    """
+    Counters for database work done by this process: connections opened,
+    statements by kind (seen through SQLite's trace hook, so statements run
+    inside transactions count too) and time spent opening connections, in
+    execute() and in write transactions.
+    """
+
+    READ_VERBS = ("SELECT", "WITH")
+    WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "VACUUM")
+    COUNTERS = {"open": "opens", "execute": "executes", "transaction": "transactions"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {
+            "reads": 0, "writes": 0, "opens": 0, "executes": 0, "transactions": 0,
+            "open_seconds": 0.0, "execute_seconds": 0.0, "transaction_seconds": 0.0,
+        }
+
+    def trace(self, statement):
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        if verb in self.READ_VERBS:
+            kind = "reads"
+        elif verb in self.WRITE_VERBS:
+            kind = "writes"
+        else:
+            return # BEGIN/COMMIT/PRAGMA and statements run by triggers
+        with self._lock:
+            self.totals[kind] += 1
+
+    def record(self, name, seconds):
+        """Time one "open", "execute" or "transaction"."""
+        with self._lock:
+            self.totals[self.COUNTERS[name]] += 1
+            self.totals[f"{name}_seconds"] += seconds
+        DB_SECONDS.observe(seconds, operation=name)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.totals)
+
+
+class _Rows:
+    """Result of a statement run on gevent's threadpool, fetched in full; reads like a cursor."""
+
+    def __init__(self, cursor):
+        self._rows = cursor.fetchall()
+        self._pos = 0
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchall(self):
+        rows, self._pos = self._rows[self._pos:], len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class SQLiteBackend:
+    """
+    Record-level store on top of SQLite in WAL mode.
+    Each thread gets its own connection; WAL lets the bot and the webapp read
+    while the other one writes. Writers in any process (bot, gunicorn workers)
+    are serialized by SQLite's own file locks: transaction() takes the write
+    lock up front with BEGIN IMMEDIATE.
+
+    Under gevent workers thread-locals are per greenlet, so connections come
+    from a small pool instead, and statements plus BEGIN/COMMIT run on gevent's
+    threadpool: a wait for the write lock then blocks one OS thread, not every
+    request in the worker. Statements inside a transaction run directly, since
+    the lock is already held.
+    """
+
+    def __init__(self, path, legacy_shelve_file=None):
+        self.path = path
+        self._local = threading.local()
+        self.stats = DBStats()
+        self._threadpool = gevent_threadpool()
+        self._idle = []
+        self._pool_slots = threading.BoundedSemaphore(POOL_CONNECTIONS)
+        # Several processes may start at once; only one may create the schema
+        # and import the legacy shelve file.
+        with self._file_lock():
+            is_new = not os.path.exists(path)
+            conn = self.connection()
+            conn.executescript(SCHEMA)
+            self._migrate_links_uuid()
+            self.has_fts = self._create_notes_fts()
+            if is_new and legacy_shelve_file:
+                self._import_shelve(legacy_shelve_file)
+            # Also covers links and cache entries that arrived by the shelve import or db_tool
+            conn.execute(LINKS_UUID_BACKFILL)
+            self._migrate_kv_queue()
+
+    def _migrate_links_uuid(self):
+        conn = self.connection()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(links)")}
+        if "uuid" not in columns:
+            print("Adding Minecraft UUIDs to links...")
+            conn.executescript(LINKS_UUID_MIGRATION)
+            conn.executescript(SCHEMA)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_links_uuid ON links (uuid)")
+
+    def _create_notes_fts(self):
+        """
+        Full-text index over note text, kept in sync by triggers. Returns False
+        when this SQLite build lacks FTS5; note search then falls back to LIKE.
+        """
+        conn = self.connection()
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_notes_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            conn.executescript(NOTES_FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"Full-text note search unavailable ({e}); using slower substring search.")
+            return False
+        conn.execute("INSERT INTO user_notes_fts (user_notes_fts) VALUES ('rebuild')") # Index existing notes
+        return True
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self):
+        started = time.perf_counter()
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves in transaction()
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.set_trace_callback(self.stats.trace)
+        self.stats.record("open", time.perf_counter() - started)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    # --- pooled connections for gevent workers ---
+    def _checkout(self):
+        self._pool_slots.acquire() # Waits (cooperatively) while every connection is in use
+        try:
+            return self._idle.pop() if self._idle else self._open()
+        except BaseException:
+            self._pool_slots.release()
+            raise
+
+    def _checkin(self, conn):
+        self._idle.append(conn)
+        self._pool_slots.release()
+
+    def _execute_pooled(self, sql, params):
+        conn = self._checkout()
+        try:
+            return self._threadpool.apply(lambda: _Rows(conn.execute(sql, params)))
+        finally:
+            self._checkin(conn)
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            if self._threadpool is None:
+                return self.connection().execute(sql, params)
+            conn = getattr(self._local, "transaction_conn", None)
+            if conn is not None:
+                return conn.execute(sql, params)
+            return self._execute_pooled(sql, params)
+        finally:
+            self.stats.record("execute", time.perf_counter() - started)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block in one write transaction. The write lock is taken at BEGIN,
+        so a read-modify-write inside the block cannot interleave with another
+        writer. Nested calls join the outer transaction.
+        """
+        if self._threadpool is not None:
+            with self._pooled_transaction() as conn:
+                yield conn
+            return
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self.stats.record("transaction", time.perf_counter() - started)
+
+    @contextmanager
+    def _pooled_transaction(self):
+        conn = getattr(self._local, "transaction_conn", None)
+        if conn is not None:
+            yield conn
+            return
+        started = time.perf_counter()
+        conn = self._checkout()
+        try:
+            self._threadpool.apply(conn.execute, ("BEGIN IMMEDIATE",))
+        except BaseException:
+            self._checkin(conn)
+            raise
+        self._local.transaction_conn = conn
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            try:
+                self._threadpool.apply(conn.execute, ("COMMIT",)) # May checkpoint the WAL
+            except BaseException:
+                conn.execute("ROLLBACK") # Don't hand an open transaction to the next user
+                raise
+        finally:
+            self._local.transaction_conn = None
+            self._checkin(conn)
+            self.stats.record("transaction", time.perf_counter() - started)
+
+    # --- maintenance ---
+    def size_on_disk(self):
+        """Bytes used by the database file plus its WAL."""
+        return sum(
+            os.path.getsize(p) for p in (self.path, f"{self.path}-wal") if os.path.exists(p)
+        )
+
+    def snapshot(self, dest_path):
+        """
+        Write a consistent point-in-time copy to dest_path using SQLite's online
+        backup API. Readers and writers keep working while it runs.
+        """
+        tmp_path = f"{dest_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        dest = sqlite3.connect(tmp_path)
+        try:
+            self.connection().backup(dest, pages=1024)
+        finally:
+            dest.close()
+        os.replace(tmp_path, dest_path) # Never leave a half-written snapshot under the real name
+
+    def compact(self):
+        """Fold the WAL back into the database and rebuild it without free pages."""
+        conn = self.connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM") # Readers continue under WAL; writers wait up to BUSY_TIMEOUT
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA optimize")
+
+    # --- generic key/value ---
+    def get_kv(self, key):
+        row = self.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def get_many_kv(self, keys):
+        keys = list(keys)
+        rows = self.execute(
+            "SELECT key, value FROM kv WHERE key IN (%s)" % ",".join("?" * len(keys)), keys
+        )
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def set_kv(self, key, value):
+        self.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, pickle.dumps(value)),
+        )
+
+    def delete_kv(self, key):
+        self.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    # --- whole-value compatibility layer ---
+    # The keys below used to be single shelve entries holding a whole dict (or a
+    # JSON string of one). They are now tables; get_value/set_value still accept
+    # and return the old shapes so existing callers keep working.
+    def get_value(self, key):
+        if key == "links":
+            return dict(self.execute("SELECT discord_id, minecraft_name FROM links"))
+        if key == "user_notes":
+            notes = {}
+            for user_key, note, author, timestamp in self.execute(
+                "SELECT user_key, note, author, timestamp FROM user_notes ORDER BY id"
+            ):
+                notes.setdefault(user_key, []).append({"note": note, "author": author, "timestamp": timestamp})
+            return notes
+        if key == "user_flags":
+            return dict(self.execute("SELECT user_key, flag FROM user_flags"))
+        if key == "applications":
+            rows = self.execute("SELECT message_id, data FROM applications")
+            return json.dumps({message_id: json.loads(data) for message_id, data in rows})
+        if key == "pending_applications_queue":
+            rows = self.execute("SELECT payload FROM application_queue ORDER BY id")
+            return [json.loads(payload) for (payload,) in rows]
+        if key == "player_cache":
+            rows = self.execute("SELECT username, data, timestamp FROM player_cache")
+            return json.dumps({
+                username: {"data": json.loads(data) if data is not None else None, "timestamp": timestamp}
+                for username, data, timestamp in rows
+            })
+        return self.get_kv(key)
+
+    def set_value(self, key, value):
+        with self.transaction() as conn:
+            if key == "links":
+                # Apply only the differences: unchanged links keep their UUID and
+                # don't show up as remove+add on the live roster stream
+                new = {str(k): v for k, v in (value or {}).items()}
+                current = dict(conn.execute("SELECT discord_id, minecraft_name FROM links"))
+                conn.executemany(
+                    "DELETE FROM links WHERE discord_id = ?", [(k,) for k in current if k not in new]
+                )
+                conn.executemany(
+                    "INSERT INTO links (discord_id, minecraft_name) VALUES (?, ?) "
+                    "ON CONFLICT(discord_id) DO UPDATE SET minecraft_name = excluded.minecraft_name, uuid = CASE "
+                    "WHEN links.minecraft_name = excluded.minecraft_name COLLATE NOCASE THEN links.uuid END",
+                    [(k, v) for k, v in new.items() if current.get(k) != v],
+                )
+            elif key == "user_notes":
+                conn.execute("DELETE FROM user_notes")
+                conn.executemany(
+                    "INSERT INTO user_notes (user_key, note, author, timestamp) VALUES (?, ?, ?, ?)",
+                    [
+                        (str(user_key), entry.get("note", ""), entry.get("author"), entry.get("timestamp"))
+                        for user_key, entries in (value or {}).items()
+                        for entry in entries
+                    ],
+                )
+            elif key == "user_flags":
+                conn.execute("DELETE FROM user_flags")
+                conn.executemany(
+                    "INSERT INTO user_flags (user_key, flag) VALUES (?, ?)",
+                    [(str(k), v) for k, v in (value or {}).items() if v is not None],
+                )
+            elif key == "applications":
+                apps = json.loads(value or "{}") if isinstance(value, str) else (value or {})
+                conn.execute("DELETE FROM applications")
+                conn.executemany(
+                    "INSERT INTO applications (message_id, data) VALUES (?, ?)",
+                    [(str(k), json.dumps(v)) for k, v in apps.items()],
+                )
+            elif key == "pending_applications_queue":
+                conn.execute("DELETE FROM application_queue")
+                self.enqueue(value or [])
+            elif key == "player_cache":
+                cache = json.loads(value or "{}") if isinstance(value, str) else (value or {})
+                conn.execute("DELETE FROM player_cache")
+                conn.executemany(
+                    "INSERT INTO player_cache (username, data, timestamp) VALUES (?, ?, ?)",
+                    [
+                        (
+                            username.lower(),
+                            json.dumps(entry["data"]) if entry.get("data") is not None else None,
+                            entry.get("timestamp", 0),
+                        )
+                        for username, entry in cache.items()
+                    ],
+                )
+            else:
+                self.set_kv(key, value)
+
+    # --- application queue ---
+    def enqueue(self, payloads):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO application_queue (payload, enqueued_at, visible_at) VALUES (?, ?, ?)",
+                [(json.dumps(p), now, now) for p in payloads],
+            )
+
+    def _migrate_kv_queue(self):
+        """Move a queue stored as a pickled list in kv into the queue table."""
+        with self.transaction():
+            pending = self.get_kv("pending_applications_queue")
+            if pending is not None:
+                self.enqueue(pending)
+                self.delete_kv("pending_applications_queue")
+
+    # --- one-time migration from the old shelve file ---
+    def _import_shelve(self, shelve_file):
+        if dbm.whichdb(shelve_file) in (None, ""):
+            return
+        print(f"Importing legacy shelve database '{shelve_file}' into {self.path}...")
+        with shelve.open(shelve_file, flag="r") as db:
+            for key in db.keys():
+                try:
+                    self.set_value(key, db[key])
+                except Exception as e:
+                    print(f"Skipping legacy key {key!r}: {e}")
+        print("Legacy shelve import finished.")
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+}
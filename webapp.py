@@ -1,14 +1,44 @@
 # webapp.py
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, g, request, jsonify, redirect, url_for, send_file
 import requests
 from urllib.parse import urlencode
 import os
+import json
+import threading
+import re
+import math
+import base64
 import time # For player skin caching logic if directly used here
+from collections import OrderedDict
 
 # Import database functions
-from database import get_value, set_value, add_application_to_queue, get_cached_player_skin, cache_player_skin
+from database import (
+    add_application_to_queue, peek_player_skin, get_change_version,
+    get_queue_depth, find_pending_application, take_token, get_links_page, get_db_stats,
+    is_known_uuid,
+)
+from skin_refresher import refresher
+from roster_stream import broadcaster
+from http_client import client as http
+from config import config
+from notify import notify_bot
+import avatars
+import assets
+import metrics
+from compression import CompressedBody, PageCache, respond
 
 app = Flask(__name__)
+assets.register(app)
+if int(os.environ.get("DWP_PROXY_COUNT", 0)):
+    # Behind a reverse proxy: take the client address from X-Forwarded-For
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["DWP_PROXY_COUNT"]), x_proto=1)
+# Pages are rendered once per template change (see PageCache), so have Jinja
+# notice edited templates instead of serving its own cached copy forever
+app.jinja_env.auto_reload = True
+pages = PageCache()
+# Behind nginx/Apache, let the proxy send static files (X-Sendfile) instead of Python
+app.config["USE_X_SENDFILE"] = os.environ.get("DWP_X_SENDFILE") == "1"
 
 # Create a templates directory and add your HTML files there
 # templates/index.html
@@ -47,10 +77,11 @@ if not os.path.exists("templates/whitelist.html"):
             <input type="text" id="in_game_name" name="in_game_name" required><br>
             <label for="why_join">Why do you want to join?:</label><br>
             <textarea id="why_join" name="why_join" required></textarea><br><br>
-            <input type="hidden" id="code" name="code" value="{{ code }}">
+            <input type="hidden" id="code" name="code">
             <button type="submit">Submit Application</button>
         </form>
         <script>
+            document.getElementById('code').value = new URLSearchParams(window.location.search).get('code');
             document.getElementById('whitelistForm').addEventListener('submit', async function(event) {
                 event.preventDefault();
                 const formData = new FormData(event.target);
@@ -79,63 +110,305 @@ if not os.path.exists("templates/success.html"):
         f.write(default_html_content.format(title="Success", heading="Application Submitted!", message="Your application has been submitted successfully.", extra_content=""))
 
 
-# Mojang API interaction with caching
+# Mojang data is served from the cache only, stale or not. skin_refresher keeps
+# entries fresh in the background and resolves names we have never seen, so a
+# page request never waits on Mojang.
 def get_player_skin(username):
-    cached_data = get_cached_player_skin(username)
-    if cached_data:
-        return cached_data
-    
-    try:
-        uuid_response = requests.get(f"https://api.mojang.com/users/profiles/minecraft/{username}")
-        if uuid_response.status_code != 200:
-            return None
-        uuid = uuid_response.json()['id']
-        
-        profile_response = requests.get(f"https://sessionserver.mojang.com/session/minecraft/profile/{uuid}")
-        if profile_response.status_code != 200:
-            return None
-            
-        profile_data = profile_response.json()
-        player_data = {
-            'uuid': uuid,
-            'name': profile_data['name'],
-            'profile': profile_data # Contains skin data if needed
-        }
-        cache_player_skin(username, player_data)
-        return player_data
-    except Exception as e:
-        print(f"Error fetching player skin for {username}: {e}")
-        return None
+    return get_player_skins([username]).get(username)
 
-@app.route('/api/whitelisted-players')
-def whitelisted_players_api():
-    links = get_value("links") or {}
+def get_player_skins(usernames):
+    """Cached data for many players; unknown names are handed to the refresher."""
+    players = {}
+    unknown = []
+    for username in usernames:
+        state, cached_data = peek_player_skin(username)
+        if state == "unknown":
+            unknown.append(username)
+        else:
+            players[username] = cached_data # None here means Mojang has no such player
+    if unknown:
+        refresher.request(unknown)
+    else:
+        refresher.ensure_started()
+    return players
+
+def build_players_list(links=None):
+    """
+    Player entries for [(discord_id, minecraft_name, uuid)], by default every
+    link in name order. Links store their UUID; the skin cache only fills in
+    for links name_tracker hasn't resolved yet.
+    """
+    links = get_links_page() if links is None else links
+    skins = get_player_skins([minecraft_name for _, minecraft_name, uuid in links if not uuid])
     players = []
-    for discord_id, minecraft_name in links.items():
-        player_data = get_player_skin(minecraft_name) # Uses caching
+    for discord_id, minecraft_name, uuid in links:
         player_info = {
             'name': minecraft_name,
             'discord_id': discord_id
         }
-        if player_data:
-            player_info['uuid'] = player_data['uuid']
+        if not uuid:
+            player_data = skins.get(minecraft_name)
+            uuid = player_data['uuid'] if player_data else None
+        if uuid:
+            player_info['uuid'] = uuid
         players.append(player_info)
-    return jsonify(players)
+    return players
+
+# The players list is serialized and compressed once and reused until links or
+# the player cache change (tracked by trigger-maintained counters in the
+# database, so writes made by the bot are noticed too). The ETag is a hash of
+# the body, so every worker hands out the same tag for the same list.
+PLAYERS_CACHE_CONTROL = "public, max-age=60"
+_players_payload = {"version": None, "body": None}
+_players_payload_lock = threading.Lock()
+
+def get_players_payload():
+    links_version = get_change_version("links")
+    if _players_payload["version"] == (links_version, get_change_version("player_cache")):
+        return _players_payload
+    with _players_payload_lock:
+        links_version = get_change_version("links")
+        if _players_payload["version"] == (links_version, get_change_version("player_cache")):
+            return _players_payload
+        body = json.dumps(build_players_list(), separators=(",", ":")).encode()
+        # Read the cache counter after building: resolving misses above writes to
+        # the cache and must not make the next request rebuild the same list.
+        _players_payload.update(
+            version=(links_version, get_change_version("player_cache")),
+            body=CompressedBody(body),
+        )
+        return _players_payload
+
+# With any of limit/cursor/fields/prefix the API returns one page,
+# {"players": [...], "next_cursor": ...}, read straight off the links name
+# index. Without them it returns the whole list as before. Pages are cached
+# like the full list: serialized and compressed once per (change counters,
+# query), with the body hash as ETag.
+PLAYERS_PAGE_DEFAULT = 100
+PLAYERS_PAGE_MAX = 500
+PLAYER_FIELDS = ("name", "discord_id", "uuid")
+PLAYERS_PAGE_CACHE_SIZE = 256 # Pages kept per process; the home page's first few are by far the most requested
+_players_pages = OrderedDict() # (versions, after, limit, prefix, fields) -> CompressedBody
+_players_pages_lock = threading.Lock()
+
+def encode_cursor(discord_id, minecraft_name):
+    return base64.urlsafe_b64encode(json.dumps([minecraft_name, discord_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        minecraft_name, discord_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(minecraft_name), str(discord_id)
+    except (ValueError, TypeError):
+        return None
+
+def players_page(args):
+    """(CompressedBody, error) for a paged request."""
+    try:
+        limit = int(args.get('limit', PLAYERS_PAGE_DEFAULT))
+    except ValueError:
+        return None, "limit must be a number"
+    limit = max(1, min(limit, PLAYERS_PAGE_MAX))
+    after = None
+    if args.get('cursor'):
+        after = decode_cursor(args['cursor'])
+        if after is None:
+            return None, "invalid cursor"
+    prefix = args.get('prefix') or None
+    if prefix is not None and not MINECRAFT_NAME_RE.match(prefix):
+        return None, "prefix must be the start of a Minecraft name (letters, digits, underscore; up to 16)"
+    fields = PLAYER_FIELDS
+    if args.get('fields'):
+        fields = tuple(f for f in args['fields'].split(",") if f)
+        unknown = [f for f in fields if f not in PLAYER_FIELDS]
+        if unknown:
+            return None, f"unknown fields: {', '.join(unknown)} (choose from {', '.join(PLAYER_FIELDS)})"
+
+    versions = (get_change_version("links"), get_change_version("player_cache"))
+    key = (versions, after, limit, prefix, fields)
+    with _players_pages_lock:
+        cached = _players_pages.get(key)
+        if cached is not None:
+            _players_pages.move_to_end(key)
+            return cached, None
+
+    # One extra row tells us whether there is a next page
+    links = get_links_page(after=after, limit=limit + 1, prefix=prefix)
+    has_more = len(links) > limit
+    links = links[:limit]
+    players = build_players_list(links) if "uuid" in fields else [
+        {'name': minecraft_name, 'discord_id': discord_id} for discord_id, minecraft_name, _ in links
+    ]
+    body = {
+        "players": [{f: player[f] for f in fields if f in player} for player in players],
+        "next_cursor": encode_cursor(*links[-1][:2]) if has_more else None,
+    }
+    compressed = CompressedBody(json.dumps(body, separators=(",", ":")).encode())
+    with _players_pages_lock:
+        _players_pages[key] = compressed
+        while len(_players_pages) > PLAYERS_PAGE_CACHE_SIZE:
+            _players_pages.popitem(last=False) # Least recently used, including pages of old versions
+    return compressed, None
+
+@app.route('/api/whitelisted-players')
+def whitelisted_players_api():
+    if not any(key in request.args for key in ('limit', 'cursor', 'fields', 'prefix')):
+        return respond(get_players_payload()["body"], "application/json", PLAYERS_CACHE_CONTROL)
+    compressed, error = players_page(request.args)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+    return respond(compressed, "application/json", PLAYERS_CACHE_CONTROL)
+
+@app.route('/api/roster-events')
+def roster_events():
+    """Live add/remove/rename deltas for the player grid (Server-Sent Events)."""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    response = app.response_class(broadcaster.stream(last_event_id), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no" # Don't let nginx buffer the stream
+    return response
+
+# Player faces are proxied through /avatars so the grid doesn't depend on a
+# third-party host. Only UUIDs of players we know (linked or in the player
+# cache) are proxied, so nobody can fill the cache with arbitrary faces. A
+# face that isn't on disk yet redirects to the source once (uncached) while it
+# is fetched in the background. The sprite sheet is built in the background
+# (see avatars.py); its URL carries a hash of its contents, so it can be
+# cached for good.
+AVATAR_CACHE_CONTROL = f"public, max-age={avatars.AVATAR_REVALIDATE_SECONDS}"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.route('/avatars/<uuid>.png')
+def avatar(uuid):
+    uuid = avatars.normalize_uuid(uuid)
+    if not uuid or not is_known_uuid(uuid):
+        return "Unknown player", 404
+    path = avatars.get_avatar(uuid)
+    if not path:
+        response = redirect(avatars.AVATAR_SOURCE_URL.format(uuid=uuid))
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    response = send_file(os.path.abspath(path), mimetype="image/png", conditional=True)
+    response.headers["Cache-Control"] = AVATAR_CACHE_CONTROL
+    return response
+
+SPRITE_KEY_RE = re.compile(r"^[0-9a-f]{40}$")
+
+def current_sprite():
+    """(key, png, map) of the newest finished sprite sheet, or None until one is ready."""
+    players = json.loads(get_players_payload()["body"].body)
+    return avatars.current_sprite(player["uuid"] for player in players if player.get("uuid"))
+
+@app.route('/avatars/sprite.json')
+def avatar_sprite_map():
+    sprite = current_sprite()
+    if sprite is None:
+        # Still being built; the grid loads faces one by one meanwhile
+        response = jsonify({"status": "error", "message": "sprite not ready"})
+        response.status_code = 404
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    key, _, sprite_map = sprite
+    body = {**sprite_map, "url": url_for('avatar_sprite', key=key)}
+    response = jsonify(body)
+    response.set_etag(key)
+    response.headers["Cache-Control"] = PLAYERS_CACHE_CONTROL
+    return response.make_conditional(request)
+
+@app.route('/avatars/sprite-<key>.png')
+def avatar_sprite(key):
+    if not SPRITE_KEY_RE.match(key):
+        return "Unknown sprite", 404
+    sprite = current_sprite()
+    if sprite is None or key != sprite[0]:
+        # An older sheet other workers may still hand out: serve it while it's kept
+        sprite = avatars.load_sprite(key) or sprite
+    if sprite is None:
+        return "Unknown sprite", 404
+    if key != sprite[0]:
+        # Gone from disk; send the browser to the current one
+        response = redirect(url_for('avatar_sprite', key=sprite[0]))
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    response = app.response_class(sprite[1], mimetype="image/png")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# --- Metrics ---
+# Exposed at /metrics in Prometheus text format, summed over all workers (see
+# metrics.py). Set DWP_METRICS_TOKEN to require "Authorization: Bearer <token>".
+METRICS_TOKEN = os.environ.get("DWP_METRICS_TOKEN")
+
+def process_counters():
+    rows = [
+        ("dwp_db_statements_total", "SQL statements run, by kind.", {"kind": kind}, get_db_stats().snapshot()[f"{kind}s"])
+        for kind in ("read", "write")
+    ]
+    for host, data in http.stats().items():
+        for field in ("errors", "retries", "short_circuited"):
+            rows.append((f"dwp_upstream_{field}_total", f"Outbound HTTP {field.replace('_', ' ')}, by host.", {"host": host}, data[field]))
+    for result, count in config.stats().items():
+        rows.append(("dwp_config_cache_lookups_total", "Config cache reads, by result (hits, misses).", {"result": result}, count))
+    rows.append(("dwp_skin_refresher_refreshed_total", "Player cache entries refreshed from Mojang.", {}, refresher.refreshed))
+    rows.append(("dwp_skin_refresher_failed_batches_total", "Mojang lookups that failed and were left stale.", {}, refresher.failed_batches))
+    return rows
+
+def service_gauges():
+    return [("dwp_application_queue_depth", "gauge", "Applications waiting for the bot.", {}, get_queue_depth())]
+
+metrics.registry.add_process_collector(process_counters)
+metrics.registry.add_scrape_collector(service_gauges)
+
+@app.before_request
+def start_request_timer():
+    metrics.registry.ensure_writer()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "Unauthorized", 401
+    return app.response_class(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.after_request
+def cache_static_assets(response):
+    # build_assets.py names files after their content hash, so they never change
+    if request.endpoint == "static" and assets.is_hashed_asset(request.view_args.get("filename", "")):
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# Rendered pages are shared by every visitor; browsers revalidate them with the ETag
+PAGE_CACHE_CONTROL = "no-cache"
+
+def cached_page(template_name):
+    return respond(pages.get(template_name, assets.manifest.version), "text/html", PAGE_CACHE_CONTROL)
 
 @app.route('/')
 def index():
-    return render_template("index.html")
+    return cached_page("index.html")
 
 @app.route('/whitelist')
 def whitelist_form():
     # This 'code' is now the Discord User ID after callback
     user_id = request.args.get('code')
     if user_id:
-        return render_template("whitelist.html", code=user_id)
+        return cached_page("whitelist.html") # The page reads the code from its own URL
     
     # No code, redirect to Discord OAuth
-    client_id = get_value("client_id")
-    domain = get_value("domain")
+    settings = config.current()
+    client_id = settings.client_id
+    domain = settings.domain
     if not client_id or not domain:
         return "Error: Discord application not configured properly. Missing Client ID or Domain.", 500
     
@@ -149,15 +422,18 @@ def whitelist_form():
     auth_url = f"https://discord.com/oauth2/authorize?{urlencode(params)}"
     return redirect(auth_url)
 
+DISCORD_API_URL = os.environ.get("DISCORD_API_URL", "https://discord.com/api") # Overridable for testing
+
 @app.route('/callback')
 def callback():
     auth_code = request.args.get('code')
     if not auth_code:
         return "Error: No authorization code provided by Discord.", 400
 
-    client_id = get_value("client_id")
-    client_secret = get_value("secret")
-    domain = get_value("domain")
+    settings = config.current()
+    client_id = settings.client_id
+    client_secret = settings.secret
+    domain = settings.domain
 
     if not client_id or not client_secret or not domain:
         return "Error: Discord application not configured properly on the server.", 500
@@ -173,12 +449,13 @@ def callback():
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
     
     try:
-        token_response = requests.post('https://discord.com/api/oauth2/token', data=data, headers=headers)
+        # Not retried: an authorization code can only be exchanged once
+        token_response = http.post(f'{DISCORD_API_URL}/oauth2/token', data=data, headers=headers)
         token_response.raise_for_status() # Raises an exception for bad status codes
         access_token = token_response.json()['access_token']
 
         user_info_headers = {'Authorization': f'Bearer {access_token}'}
-        user_response = requests.get('https://discord.com/api/users/@me', headers=user_info_headers)
+        user_response = http.get(f'{DISCORD_API_URL}/users/@me', headers=user_info_headers)
         user_response.raise_for_status()
         user_id = user_response.json()['id']
 
@@ -190,12 +467,47 @@ def callback():
             print(f"Response content: {e.response.text}")
         return f"Error during Discord OAuth: {e}", 500
     
+# --- Admission control for /submit ---
+# Applications are shed before they reach the queue when the bot is far behind,
+# and each Discord account and client IP gets a token bucket shared by all
+# workers (see take_token), so one user can't flood staff review.
+SUBMIT_QUEUE_LIMIT = 200 # Queued applications before new ones are turned away
+SUBMIT_QUEUE_RETRY_AFTER = 120 # Seconds clients are told to wait when the queue is full
+SUBMIT_ID_BUCKET = (3, 1 / 600) # (burst, tokens per second): 3 at once, then one per 10 minutes
+SUBMIT_IP_BUCKET = (10, 1 / 60) # Shared by everyone behind one address
+DISCORD_ID_RE = re.compile(r"^\d{15,21}$")
+MINECRAFT_NAME_RE = re.compile(r"^[A-Za-z0-9_]{1,16}$") # Some legacy names are shorter than 3
+
+def submit_error(message, status, retry_after=None):
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = status
+    if retry_after:
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+def check_admission(discord_id, minecraft_name):
+    """None if the application may be queued, else the error response to send."""
+    if get_queue_depth() >= SUBMIT_QUEUE_LIMIT:
+        return submit_error("We're receiving a lot of applications right now. Please try again in a few minutes.",
+                            503, SUBMIT_QUEUE_RETRY_AFTER)
+    for key, (capacity, rate) in ((f"submit:id:{discord_id}", SUBMIT_ID_BUCKET),
+                                  (f"submit:ip:{request.remote_addr}", SUBMIT_IP_BUCKET)):
+        retry_after = take_token(key, capacity, rate)
+        if retry_after:
+            return submit_error("Too many applications. Please wait before trying again.", 429, retry_after)
+    pending = find_pending_application(discord_id, minecraft_name)
+    if pending:
+        if str(pending.get("code")) == discord_id:
+            return submit_error("You already have an application waiting for review.", 409)
+        return submit_error("An application for this Minecraft username is already waiting for review.", 409)
+    return None
+
 @app.route('/submit', methods=['POST'])
 def submit():
-    data = request.json
+    data = request.get_json(silent=True)
     
     # Validate required fields
-    if not data:
+    if not data or not isinstance(data, dict):
         return jsonify({"status": "error", "message": "No data provided"}), 400
     
     # Check for required fields
@@ -204,21 +516,37 @@ def submit():
     
     if 'in_game_name' not in data:
         return jsonify({"status": "error", "message": "Minecraft username is required"}), 400
+
+    discord_id = str(data['code']).strip()
+    minecraft_name = str(data['in_game_name']).strip()
+    if not DISCORD_ID_RE.match(discord_id):
+        return jsonify({"status": "error", "message": "Invalid Discord user ID"}), 400
+    if not MINECRAFT_NAME_RE.match(minecraft_name):
+        return jsonify({"status": "error", "message": "Invalid Minecraft username"}), 400
+
+    rejected = check_admission(discord_id, minecraft_name)
+    if rejected is not None:
+        return rejected
     
     # Log the submission
     print(f"Received whitelist application: {data}")
     
     # Ensure all required data is present in the expected format for the Discord bot
     formatted_data = {
-        'code': data['code'],                                   # Discord User ID
-        'in_game_name': data['in_game_name'],                   # Minecraft username
+        'code': discord_id,                                     # Discord User ID
+        'in_game_name': minecraft_name,                         # Minecraft username
         'playtime_experience': data.get('playtime_experience', 'Not provided'),
         'about_me': data.get('about_me', 'Not provided'),
         'public_profile': data.get('public_profile', False)
     }
     
     # Add to the application queue for the Discord bot to process
-    add_application_to_queue(formatted_data)
+    try:
+        add_application_to_queue(formatted_data)
+    except Exception as e:
+        print(f"Error queueing application: {e}")
+        return jsonify({"status": "error", "message": "Could not save your application. Please try again."}), 500
+    notify_bot() # Wake the bot so staff see it right away
     
     return jsonify({
         "status": "success", 
@@ -227,10 +555,10 @@ def submit():
 
 @app.route('/success')
 def success():
-    return render_template("success.html")
+    return cached_page("success.html")
 
 if __name__ == "__main__":
-    # For development only. Use Gunicorn or similar for production.
+    # For development only. In production: gunicorn -c gunicorn.conf.py webapp:app
     # Ensure initial setup is run if this is the first time
     # from database import initial_setup
     # initial_setup() # You might want to run this separately